@@ -0,0 +1,123 @@
+import threading
+
+import numpy as np
+
+from campaign_data import categories
+from ring_buffer import allocate_local
+
+
+class StreamingAggregates:
+    # Pre-aggregated cube over every combination of the categorical
+    # dimensions (5 x 15 x 3 x 28 cells), holding the record count and the
+    # sums of the additive measures per cell. Appends add the new rows and
+    # subtract the evicted ones; queries sum the cells of a slice, so any
+    # filter costs the same whatever the size of the window.
+    dimensions = ("AdType", "Region", "Device", "Period")
+    measures = ("Impressions", "Clicks", "Conversions", "Revenue", "Spend")
+    # Ratio metrics are derived from the sums of a slice:
+    # metric: (numerator, denominator, scale)
+    ratios = {
+        "CTR": ("Clicks", "Impressions", 100),
+        "CPC": ("Spend", "Clicks", 1),
+        "RPC": ("Revenue", "Clicks", 1),
+        "CPA": ("Spend", "Conversions", 1),
+        "ROAS": ("Revenue", "Spend", 1),
+        "ConversionRate": ("Conversions", "Clicks", 100),
+    }
+
+    def __init__(self, allocate=allocate_local, seqlock=None):
+        # With a seqlock, updates happen inside the ring buffer's write
+        # section and reads retry on it instead of taking the local lock, so
+        # the state can live in shared memory and be read by other processes.
+        self._lock = threading.Lock()
+        self._seqlock = seqlock
+        self.shape = tuple(len(categories[dimension]) for dimension in self.dimensions)
+        self.counts = allocate('cube:count', self.shape, np.int64)
+        self.sums = {measure: allocate('cube:' + measure, self.shape, np.float64) for measure in self.measures}
+
+    def _read(self, reader):
+        if self._seqlock is not None:
+            return self._seqlock.read(reader)
+        with self._lock:
+            return reader()
+
+    def _apply(self, columns, sign):
+        cells = np.ravel_multi_index([columns[dimension].astype(np.intp) for dimension in self.dimensions], self.shape)
+        size = self.counts.size
+        self.counts += sign * np.bincount(cells, minlength=size).reshape(self.shape)
+        for measure in self.measures:
+            self.sums[measure] += sign * np.bincount(cells, weights=columns[measure], minlength=size).reshape(self.shape)
+
+    def update(self, added, evicted=None):
+        with self._lock:
+            self._apply(added, 1)
+            if evicted is not None:
+                self._apply(evicted, -1)
+
+    def _masks(self, filters):
+        # filters maps a dimension to the category labels to keep; a missing
+        # or empty entry keeps every category.
+        filters = filters or {}
+        masks = []
+        for dimension in self.dimensions:
+            labels = filters.get(dimension)
+            mask = np.zeros(len(categories[dimension]), dtype=bool) if labels else np.ones(len(categories[dimension]), dtype=bool)
+            for label in labels or ():
+                mask[categories[dimension].index(label)] = True
+            masks.append(mask)
+        return masks
+
+    def _reduce(self, cells, masks, by=None):
+        # Sums the selected cells, keeping the axis of `by` (a dimension
+        # name) with unselected categories zeroed.
+        axis_by = None if by is None else self.dimensions.index(by)
+        result = cells
+        for axis in reversed(range(len(self.dimensions))):
+            if axis != axis_by:
+                result = np.compress(masks[axis], result, axis=axis).sum(axis=axis)
+        if axis_by is not None:
+            result = np.where(masks[axis_by], result, 0)
+        return result
+
+    def _slice(self, filters, by=None):
+        masks = self._masks(filters)
+
+        def read():
+            totals = {measure: self._reduce(self.sums[measure], masks, by) for measure in self.measures}
+            totals['count'] = self._reduce(self.counts, masks, by)
+            return totals
+        return self._read(read)
+
+    def _metric(self, totals, name):
+        if name in self.ratios:
+            numerator, denominator, scale = self.ratios[name]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.where(totals[denominator] > 0, totals[numerator] / totals[denominator] * scale, 0.0)
+        return totals[name]
+
+    def metric(self, name, filters=None):
+        # A measure's sum or a ratio metric over the filtered records.
+        return float(self._metric(self._slice(filters), name))
+
+    def group_metric(self, dimension, name, filters=None):
+        # One value per category of `dimension` in category order, NaN where
+        # the slice has no records.
+        totals = self._slice(filters, by=dimension)
+        return np.where(totals['count'] > 0, self._metric(totals, name), np.nan)
+
+    def groups(self, dimension, name, filters=None):
+        # Labels and values of the categories that have records.
+        values = self.group_metric(dimension, name, filters)
+        observed = np.flatnonzero(~np.isnan(values))
+        return [categories[dimension][code] for code in observed], values[observed]
+
+    def mode(self, dimension, filters=None):
+        counts = self._slice(filters, by=dimension)['count']
+        if not counts.any():
+            return None
+        return categories[dimension][int(np.argmax(counts))]
+
+    def top_k(self, dimension, name, k, filters=None):
+        labels, values = self.groups(dimension, name, filters)
+        order = np.argsort(-values, kind='stable')[:k]
+        return [labels[i] for i in order], values[order]
@@ -0,0 +1,18 @@
+// Listens for new data versions pushed by the server (/api/events) and puts
+// them in the 'data-version' store, which is what triggers the panel
+// refreshes. The browser reconnects on its own after a dropped connection,
+// and the server sends the current version first, so nothing is missed.
+(function() {
+    if (!window.EventSource) {
+        return;
+    }
+    const events = new EventSource('/api/events');
+    events.addEventListener('version', function(event) {
+        const setProps = window.dash_clientside && window.dash_clientside.set_props;
+        if (!setProps || !document.getElementById('main-container')) {
+            // the layout is not rendered yet; its first render is current
+            return;
+        }
+        setProps('data-version', {data: JSON.parse(event.data)});
+    });
+})();
@@ -0,0 +1,30 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    theme: {
+        select: function(lightClicks, darkClicks) {
+            const triggered = window.dash_clientside.callback_context.triggered.map(t => t.prop_id);
+            return triggered.includes('dark-theme-btn.n_clicks') ? 'dark' : 'light';
+        },
+
+        // Restyles the page and the figures already in the browser; no data
+        // is fetched, the server only sees the theme on its next render.
+        apply: function(theme, schemes, ...figures) {
+            const scheme = schemes[theme];
+            const pageStyle = {backgroundColor: scheme.background, color: scheme.text};
+            const themed = figures.map(function(figure) {
+                if (!figure || !figure.layout) {
+                    return window.dash_clientside.no_update;
+                }
+                const layout = Object.assign({}, figure.layout, {
+                    plot_bgcolor: scheme.plot_bg,
+                    paper_bgcolor: scheme.paper_bg,
+                    font: Object.assign({}, figure.layout.font, {color: scheme.text})
+                });
+                if (layout.geo) {
+                    layout.geo = Object.assign({}, layout.geo, {bgcolor: scheme.plot_bg});
+                }
+                return Object.assign({}, figure, {layout: layout});
+            });
+            return [pageStyle, pageStyle].concat(themed);
+        }
+    }
+});
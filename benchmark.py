@@ -0,0 +1,286 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from forecasting import forecasters
+
+# Benchmarks for the hot paths: data generation, each dashboard panel's
+# callback, the PDF report and the revenue forecast, at several window sizes.
+# Every window size runs in its own process (the window capacity is fixed
+# when dashboard is imported), so peak memory is measured per size as well.
+#
+#   python benchmark.py --output results.json
+#   python benchmark.py --baseline results.json
+
+default_sizes = [50, 1000, 10000, 100000, 1000000]
+
+# Panels are benchmarked through the Dash endpoint, so timings and payload
+# sizes include JSON serialization. Keyed by the panel's first output.
+panels = {
+    'kpis': 'rpc',
+    'charts': 'roas-by-type',
+    'trend': 'metrics-trend',
+    'region': 'region-map',
+    'forecast': 'forecast-plot',
+}
+
+
+def measure(function, repeat, setup=None):
+    # Median and minimum wall time over `repeat` runs, then one more run under
+    # tracemalloc for the peak Python/NumPy allocation. `setup` runs untimed
+    # before every call and its result is passed to `function`.
+    times = []
+    for _ in range(repeat + 1):
+        argument = setup() if setup else None
+        if len(times) == repeat:
+            tracemalloc.start()
+        started = time.perf_counter()
+        result = function(argument) if setup else function()
+        elapsed = time.perf_counter() - started
+        if len(times) == repeat:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            times.append(elapsed)
+    return {
+        'median': statistics.median(times),
+        'min': min(times),
+        'runs': repeat,
+        'peak_bytes': peak,
+    }, result
+
+
+def full_render(dashboard, panel):
+    # A panel's outputs for a first render, without the HTTP round trip
+    if panel == 'trend':
+        return dashboard.update_trend(1, None, 'light', None)
+    if panel == 'forecast':
+        return dashboard.update_forecast(1, 'all', 'light', None)
+    callback = {'kpis': dashboard.update_kpis, 'charts': dashboard.update_charts, 'region': dashboard.update_region_charts}[panel]
+    return callback(1, [], [], [], [], 'light', None)
+
+
+def callback_body(dependency, inputs, state):
+    output = dependency['output']
+    if output.startswith('..'):
+        outputs = [dict(zip(('id', 'property'), part.rsplit('.', 1))) for part in output.strip('.').split('...')]
+    else:
+        outputs = dict(zip(('id', 'property'), output.rsplit('.', 1)))
+    return {
+        'output': output,
+        'outputs': outputs,
+        'inputs': [dict(id=item['id'], property=item['property'], value=inputs.get(item['id'])) for item in dependency['inputs']],
+        'state': [dict(id=item['id'], property=item['property'], value=state.get(item['id'])) for item in dependency['state']],
+        'changedPropIds': [f"{item['id']}.{item['property']}" for item in dependency['inputs']],
+    }
+
+
+def run_window(size, repeat, skip, forecast_max, accept_encoding):
+    # Runs inside the per-size worker process.
+    import numpy as np
+    from plotly.io.json import to_json_plotly
+    import dashboard
+    from campaign_data import generate_campaign_columns
+    from reports import build_report
+
+    results = {}
+
+    def record(name, stats, payload=None):
+        if payload is not None:
+            stats['payload_bytes'] = payload
+        results[f"{name}@{size}"] = stats
+
+    rng = np.random.default_rng(size)
+    stats, _ = measure(lambda: generate_campaign_columns(size, seed=rng), repeat)
+    record('generate.window', stats)
+    stats, _ = measure(lambda: dashboard.generate_campaign_data_batch(5, seed=rng), repeat)
+    record('generate.batch_5', stats)
+    dashboard.store_batch(generate_campaign_columns(size, seed=rng))
+
+    client = dashboard.server.test_client()
+    dependencies = client.get('/_dash-dependencies').get_json()
+
+    def post(dependency, rendered_version):
+        # every panel's state is the theme and the version it last rendered
+        version_store = dependency['state'][-1]['id']
+        body = callback_body(dependency, {'data-version': 1, 'forecast-segment': 'all'}, {'theme': 'light', version_store: rendered_version})
+        # payloads are measured as sent, i.e. after any compression
+        response = client.post('/_dash-update-component', json=body, headers={'Accept-Encoding': accept_encoding})
+        if response.status_code not in (200, 204):
+            raise RuntimeError(f"{dependency['output']} answered {response.status_code}")
+        return len(response.data)
+
+    for panel, output_id in panels.items():
+        if panel in skip or (panel == 'forecast' and size > forecast_max):
+            continue
+        dependency = next(item for item in dependencies if item['output'].strip('.').startswith(output_id + '.'))
+        if panel == 'forecast':
+            # Time serving the cached forecast, not the background fit.
+            dashboard.forecast_service.get(dashboard.ad_data.version, timeout=600)
+        # Rendered panels are cached per data version; "full" renders from
+        # scratch, "cached" is every further client asking for the same one.
+        stats, payload = measure(lambda _: post(dependency, None), repeat, setup=dashboard.render_cache.clear)
+        record(f"callback.{panel}.full", stats, payload)
+        # Encoding the outputs to JSON, as Dash does for every response
+        stats, encoded = measure(to_json_plotly, repeat, setup=lambda: (dashboard.render_cache.clear(), full_render(dashboard, panel))[1])
+        record(f"encode.{panel}", stats, len(encoded))
+        if panel == 'forecast':
+            continue
+        stats, payload = measure(lambda: post(dependency, None), repeat)
+        record(f"callback.{panel}.cached", stats, payload)
+        stats, payload = measure(lambda token: post(dependency, token), repeat, setup=lambda: dashboard.data_token())
+        record(f"callback.{panel}.unchanged", stats, payload)
+
+        def new_rows():
+            token = dashboard.data_token()
+            dashboard.generate_campaign_data_batch(5, seed=rng)
+            return token
+        stats, payload = measure(lambda token: post(dependency, token), repeat, setup=new_rows)
+        record(f"callback.{panel}.new_rows", stats, payload)
+
+    columns = dashboard.ad_data.snapshot()[1]
+    if 'report' not in skip:
+        stats, pdf = measure(lambda: build_report(columns), max(1, min(repeat, 3)))
+        record('report.build', stats, len(pdf))
+    if size <= forecast_max:
+        revenue = columns['Revenue']
+        # Accuracy on a holdout: fit without the last `horizon` points and
+        # score the forecast of exactly those points.
+        horizon = max(1, min(30, size // 5))
+        for engine, fit in forecasters.items():
+            if engine in skip:
+                continue
+            stats, _ = measure(lambda: fit(revenue), max(1, min(repeat, 3)))
+            forecast = {name: np.asarray(values)[-horizon:] for name, values in fit(revenue[:-horizon], periods=horizon).items()}
+            actual = revenue[-horizon:]
+            errors = forecast['yhat'] - actual
+            stats['holdout_rmse'] = float(np.sqrt(np.mean(errors ** 2)))
+            stats['holdout_mae'] = float(np.mean(np.abs(errors)))
+            stats['interval_coverage'] = float(np.mean((actual >= forecast['yhat_lower']) & (actual <= forecast['yhat_upper'])))
+            record(f"forecast.{engine}", stats)
+
+    # ru_maxrss is in kilobytes on Linux
+    results[f"process.max_rss@{size}"] = {'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    return results
+
+
+def run(sizes, repeat, skip, forecast_max, accept_encoding):
+    results = {}
+    for size in sizes:
+        print(f"window {size}...", file=sys.stderr)
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as output:
+            path = output.name
+        try:
+            command = [sys.executable, os.path.abspath(__file__), '--worker', str(size), '--worker-output', path,
+                       '--repeat', str(repeat), '--forecast-max', str(forecast_max), '--accept-encoding', accept_encoding]
+            for name in skip:
+                command += ['--skip', name]
+            env = dict(os.environ, ADLIBS_BUFFER_CAPACITY=str(size))
+            env.pop('ADLIBS_SHARED_STORE', None)
+            env.pop('ADLIBS_HISTORY_DIR', None)
+            subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+            with open(path) as worker_output:
+                results.update(json.load(worker_output))
+        finally:
+            os.remove(path)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, tolerance, noise=0.001):
+    # A benchmark regresses when its median time, peak memory, payload or
+    # forecast error grows by more than `tolerance` (a fraction) over the baseline. Timings
+    # that differ by less than `noise` seconds are ignored.
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in ('median', 'peak_bytes', 'payload_bytes', 'max_rss_bytes', 'holdout_rmse'):
+            if metric not in current or not previous.get(metric):
+                continue
+            if metric == 'median' and current[metric] - previous[metric] < noise:
+                continue
+            ratio = current[metric] / previous[metric]
+            if ratio > 1 + tolerance:
+                regressions.append((name, metric, previous[metric], current[metric], ratio))
+    return regressions
+
+
+def print_results(results):
+    for name, stats in sorted(results.items(), key=lambda item: (int(item[0].rsplit('@', 1)[1]), item[0])):
+        if 'median' in stats:
+            line = f"{name:40} {stats['median'] * 1000:10.2f} ms  peak {stats['peak_bytes'] / 2 ** 20:8.1f} MiB"
+            if 'payload_bytes' in stats:
+                line += f"  payload {stats['payload_bytes'] / 1024:10.1f} KiB"
+            if 'holdout_rmse' in stats:
+                line += f"  holdout rmse {stats['holdout_rmse']:.2f} mae {stats['holdout_mae']:.2f} coverage {stats['interval_coverage']:.0%}"
+        else:
+            line = f"{name:40} max rss {stats['max_rss_bytes'] / 2 ** 20:8.1f} MiB"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Ad-Libs hot paths")
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes, help="window sizes in records")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument('--skip', action='append', default=[], choices=list(panels) + ['report'] + list(forecasters),
+                        help="leave out a panel, the report or a forecasting engine")
+    parser.add_argument('--forecast-max', type=int, default=2000,
+                        help="largest window the forecast is fitted on (one point per day)")
+    parser.add_argument('--accept-encoding', default='br, gzip',
+                        help="Accept-Encoding sent with callback requests, as a browser would ('' for none)")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="compare against results saved with --output")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed growth over the baseline")
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        with open(args.worker_output, 'w') as output:
+            json.dump(run_window(args.worker, args.repeat, args.skip, args.forecast_max, args.accept_encoding), output)
+        return 0
+
+    results = run(args.sizes, args.repeat, args.skip, args.forecast_max, args.accept_encoding)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'machine': platform.platform(),
+                'results': results,
+            }, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for name, metric, previous, current, ratio in regressions:
+            print(f"REGRESSION {name} {metric}: {previous:.6g} -> {current:.6g} ({ratio:.2f}x)")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline} (commit {baseline.get('commit')})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import time
+
+import numpy as np
+
+ad_types = ["Search", "Display", "Video", "Social Media", "Email"]
+regions = ["United States", "Canada", "United Kingdom", "France", "Germany", "Spain", "Italy", "China", "Japan", "India", "Australia", "Brazil", "South Africa", "Russia", "Mexico"]
+devices = ["Mobile", "Desktop", "Tablet"]
+days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+periods = ["Morning", "Afternoon", "Evening", "Night"]
+# ISO 3166-1 alpha-3 codes, so maps locate regions without resolving names
+region_iso3 = {
+    "United States": "USA", "Canada": "CAN", "United Kingdom": "GBR", "France": "FRA", "Germany": "DEU",
+    "Spain": "ESP", "Italy": "ITA", "China": "CHN", "Japan": "JPN", "India": "IND", "Australia": "AUS",
+    "Brazil": "BRA", "South Africa": "ZAF", "Russia": "RUS", "Mexico": "MEX",
+}
+# "Period" is the day and the part of the day, e.g. "Monday Morning"; its code is day * 4 + period
+period_labels = [day + " " + period for day in days for period in periods]
+
+categories = {
+    "AdType": ad_types,
+    "Region": regions,
+    "Device": devices,
+    "Period": period_labels,
+}
+
+
+def derive_metrics(columns):
+    # Same formulas and rounding as the per-record generator; every metric is
+    # computed column-wise. Zero denominators give 0 like the scalar version.
+    impressions = columns["Impressions"].astype(np.float64)
+    clicks = columns["Clicks"].astype(np.float64)
+    conversions = columns["Conversions"].astype(np.float64)
+    revenue = columns["Revenue"]
+    cpc = columns["CPC"]
+
+    spend = np.round(clicks * cpc, 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns["CTR"] = np.round(np.where(impressions > 0, clicks / impressions * 100, 0), 2)
+        columns["Spend"] = spend
+        columns["ROAS"] = np.round(np.where(spend > 0, revenue / spend, 0), 2)
+        columns["RPC"] = np.round(np.where(clicks > 0, revenue / clicks, 0), 2)
+        columns["CPA"] = np.round(np.where(conversions > 0, spend / conversions, 0), 2)
+        columns["ConversionRate"] = np.round(np.where(clicks > 0, conversions / clicks * 100, 0), 2)
+        columns["ROI"] = np.round(np.where(spend > 0, (revenue - spend) / spend * 100, 0), 2)
+    return columns
+
+
+def generate_campaign_columns(num_records, seed=None, timestamp=None):
+    # Vectorized counterpart of generate_campaign_data_batch: draws every column
+    # in one pass and returns {column: ndarray}. Categorical columns hold codes
+    # into `categories`; CampaignID is the 32-bit short id of the campaign and
+    # Timestamp the epoch seconds the batch was produced at.
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    n = int(num_records)
+
+    impressions = rng.integers(1000, 100000, size=n, endpoint=True)
+    clicks = rng.integers(10, (impressions * 0.2).astype(np.int64), endpoint=True)
+    conversions = rng.integers(1, (clicks * 0.1).astype(np.int64), endpoint=True)
+    cpc = np.round(rng.uniform(0.1, 5.0, size=n), 2)
+    revenue = np.round(conversions * rng.uniform(5, 100, size=n), 2)
+    bounce_rate = np.round(rng.uniform(30, 70, size=n), 2)
+    day = rng.integers(0, len(days), size=n)
+    period = rng.integers(0, len(periods), size=n)
+
+    columns = {
+        "CampaignID": rng.integers(0, 2 ** 32, size=n, dtype=np.uint32),
+        "AdType": rng.integers(0, len(ad_types), size=n).astype(np.int8),
+        "Region": rng.integers(0, len(regions), size=n).astype(np.int8),
+        "Device": rng.integers(0, len(devices), size=n).astype(np.int8),
+        "Impressions": impressions.astype(np.int32),
+        "Clicks": clicks.astype(np.int32),
+        "CPC": cpc,
+        "Conversions": conversions.astype(np.int32),
+        "Revenue": revenue,
+        "BounceRate": bounce_rate,
+        "Period": (day * len(periods) + period).astype(np.int8),
+        "Timestamp": np.full(n, time.time() if timestamp is None else timestamp, dtype=np.float64),
+    }
+    return derive_metrics(columns)
+
+
+def columns_to_frame(columns):
+    import pandas as pd
+
+    data = {}
+    for name, values in columns.items():
+        if name in categories:
+            data[name] = pd.Categorical.from_codes(values, categories=categories[name])
+        else:
+            data[name] = values
+    return pd.DataFrame(data, copy=False)
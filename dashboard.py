@@ -1,51 +1,128 @@
-import matplotlib
-matplotlib.use('Agg')
+import time
+# Measured from the first line so the startup report covers every import.
+import_started = time.perf_counter()
 
 import dash
 from dash import dcc, html
-from dash import ctx as dash_ctx
 import plotly.graph_objs as go
-import plotly.express as px
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import random
-from faker import Faker
-import time
+from plotly.colors import sequential
 import threading
 import numpy as np
-from prophet import Prophet
-from datetime import datetime, timedelta
-import io
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-
-app = dash.Dash(__name__, external_stylesheets=['https://cdn.jsdelivr.net/npm/bootstrap@5.2.3/dist/css/bootstrap.min.css'])
-server = app.server
-app.title = "Ad-Libs"
+import os
+import tempfile
+import json
+from collections import OrderedDict
+from campaign_data import generate_campaign_columns, categories, regions, region_iso3
+from ring_buffer import CampaignRingBuffer
+from aggregates import StreamingAggregates
+from sketches import CampaignSketches
+from rollups import TimeRollups, lttb
+from forecasting import ForecastService, forecast_dates, forecast_requests, get_forecaster
+from shared_store import SharedCampaignStore
+from history import CampaignHistory
+from ingest import IngestQueue, SpoolIngestQueue, register_ingest_route
+from reports import ReportService
+from loadgen import LoadProfile, parse_bursts, schedule, paced
+from metrics import registry, timed, observe_stage, register_metrics_route, CounterGauge
+from push import VersionNotifier, register_events_route
+from encoding import compact_outputs, register_compression
+
+# Seconds spent importing this module, building the app and starting the
+# producer; the forecasting and PDF stacks are only imported on first use.
+startup_timings = {}
+
+BUFFER_CAPACITY = int(os.environ.get('ADLIBS_BUFFER_CAPACITY', 50))
+SHARED_STORE = os.environ.get('ADLIBS_SHARED_STORE')
+HISTORY_DIR = os.environ.get('ADLIBS_HISTORY_DIR')
+
+# Forecast workers are started with "spawn" and, when the app runs as a
+# script, re-import this module as __mp_main__; they must neither join the
+# shared store nor produce data.
+serving_process = __name__ != '__mp_main__'
+
+if SHARED_STORE and serving_process:
+    # Every worker maps the same window; only the producer generates data.
+    shared_store = SharedCampaignStore(SHARED_STORE, BUFFER_CAPACITY)
+    ad_data = shared_store.buffer
+    aggregates = shared_store.aggregates
+    sketches = shared_store.sketches
+    rollups = shared_store.rollups
+    is_producer = shared_store.is_producer
+else:
+    ad_data = CampaignRingBuffer(capacity=BUFFER_CAPACITY)
+    aggregates = StreamingAggregates()
+    sketches = CampaignSketches()
+    rollups = TimeRollups()
+    ad_data.subscribe(aggregates.update)
+    ad_data.subscribe(sketches.update)
+    ad_data.subscribe(rollups.update)
+    is_producer = serving_process
 
-current_theme = 'light'
-fake = Faker()
+# Revenue is forecast for all records and separately for every ad type and
+# region; segment names are "all" or "<dimension>=<category>".
+forecast_dimensions = {'AdType': 'Ad type', 'Region': 'Region'}
+forecast_segments = ['all'] + [
+    f"{dimension}={label}" for dimension in forecast_dimensions for label in categories[dimension]
+]
 
-ad_types = ["Search", "Display", "Video", "Social Media", "Email"]
-regions = ["United States", "Canada", "United Kingdom", "France", "Germany", "Spain", "Italy", "China", "Japan", "India", "Australia", "Brazil", "South Africa", "Russia", "Mexico"]
-devices = ["Mobile", "Desktop", "Tablet"]
-days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-periods = ["Morning", "Afternoon", "Evening", "Night"]
+def forecast_segment_label(segment):
+    if segment == 'all':
+        return 'All campaigns'
+    dimension, label = segment.split('=', 1)
+    return f"{forecast_dimensions[dimension]}: {label}"
 
-ad_data = []
-previous_kpis = {
+def segment_revenue(columns, segment):
+    if segment == 'all':
+        return columns['Revenue'].copy()
+    dimension, label = segment.split('=', 1)
+    return columns['Revenue'][columns[dimension] == categories[dimension].index(label)]
+
+def forecast_source():
+    return ad_data.snapshot(lambda columns: {segment: segment_revenue(columns, segment) for segment in forecast_segments})
+
+# holt-winters (default) fits in milliseconds; prophet is heavier and
+# imported only when selected. Segment fits are spread over a process pool.
+FORECASTER = os.environ.get('ADLIBS_FORECASTER', 'holt-winters')
+forecast_service = ForecastService(
+    forecast_source,
+    fit=get_forecaster(FORECASTER),
+    max_processes=int(os.environ.get('ADLIBS_FORECAST_PROCESSES', min(4, os.cpu_count() or 1)))
+)
+
+def report_source():
+    return ad_data.snapshot()
+
+# Under the shared store finished reports are kept in a directory all
+# workers read, so a poll can be answered by any of them.
+report_service = ReportService(
+    report_source,
+    directory=os.path.join(tempfile.gettempdir(), f"{SHARED_STORE}.reports") if SHARED_STORE else None
+)
+FORECAST_FIRST_FIT_TIMEOUT = float(os.environ.get('ADLIBS_FORECAST_FIRST_FIT_TIMEOUT', 10))
+# KPI values of the latest and the previous data version per filter
+# selection, shared by every client so the trend arrows agree no matter when
+# a client refreshes. Only the most recently used selections are kept.
+empty_kpis = {
     'rpc': 0,
     'ctr': 0,
     'cpc': 0,
-    'cpa': 0
+    'cpa': 0,
+    'peak': 'N/A'
 }
+KPI_CACHE_SIZE = 64
+# Percentile cards: card id -> (title, sketch column, prefix, suffix). They
+# come from the quantile sketches, which cover the whole window and ignore
+# the filters.
+percentile_cards = {
+    'rpc-percentiles': ("RPC", "RPC", '$', ''),
+    'cpc-percentiles': ("CPC", "CPC", '$', ''),
+    'cpa-percentiles': ("CPA", "CPA", '$', ''),
+    'bounce-percentiles': ("Bounce Rate", "BounceRate", '', '%'),
+}
+kpi_cache = OrderedDict()
+kpi_lock = threading.Lock()
 
 def format_kpi_value(current, previous, prefix='', suffix=''):
-    global current_theme
-    
     try:
         if isinstance(current, str):
             if '$' in current:
@@ -70,7 +147,7 @@ def format_kpi_value(current, previous, prefix='', suffix=''):
    
     if previous == 0:
         arrow = ''
-        color = color_schemes[current_theme]['text']
+        color = 'inherit'
     else:
         pct_change = ((current - previous) / previous) * 100
         is_increasing = pct_change > 0
@@ -86,7 +163,7 @@ def format_kpi_value(current, previous, prefix='', suffix=''):
     
     return html.Div([
         html.Span(formatted_value, 
-                 style={'color': color_schemes[current_theme]['text']}),
+                 style={'color': 'inherit'}),
         html.Span(arrow, 
                  style={
                      'color': color,
@@ -96,63 +173,126 @@ def format_kpi_value(current, previous, prefix='', suffix=''):
                  })
     ])
 
-def generate_campaign_data_batch(num_records):
-    global ad_data
-    for _ in range(num_records):
-        campaign_id = fake.uuid4()
-        short_campaign_id = campaign_id.split('-')[0]
-        ad_type = random.choice(ad_types)
-        region = random.choice(regions)
-        device = random.choice(devices)
-        
-        impressions = random.randint(1000, 100000)
-        clicks = random.randint(10, int(impressions * 0.2))
-        ctr = round((clicks / impressions) * 100, 2)
-        cpc = round(random.uniform(0.1, 5.0), 2)
-        conversions = random.randint(1, int(clicks * 0.1))
-        revenue = round(conversions * random.uniform(5, 100), 2)
-        spend = round(clicks * cpc, 2)
-        roas = round(revenue / spend, 2) if spend > 0 else 0
-        cpa = round(spend / conversions, 2) if conversions > 0 else 0
-        conversion_rate = round((conversions / clicks) * 100, 2) if clicks > 0 else 0
-        rpc = round(revenue / clicks, 2) if clicks > 0 else 0
-        bounce_rate = round(random.uniform(30, 70), 2)
-        roi = round(((revenue - spend) / spend) * 100, 2) if spend > 0 else 0
-        day = random.choice(days)
-        period = random.choice(periods)
-        
-        ad_data.append({
-            "CampaignID": short_campaign_id,
-            "FullCampaignID": campaign_id,
-            "AdType": ad_type,
-            "Region": region,
-            "Device": device,
-            "Impressions": impressions,
-            "Clicks": clicks,
-            "CTR": ctr,
-            "CPC": cpc,
-            "Conversions": conversions,
-            "Revenue": revenue,
-            "Spend": spend,
-            "ROAS": roas,
-            "RPC": rpc,
-            "CPA": cpa,
-            "ConversionRate": conversion_rate,
-            "BounceRate": bounce_rate,
-            "ROI": roi,
-            "Period": day + " " + period,
-        })
-
-        if len(ad_data) > 50:
-            ad_data.pop(0)
+callbacks_served = registry.counter('adlibs_callbacks_served_total', "Panel refreshes by panel and response (full, patch, unchanged or empty)")
+records_generated = registry.counter('adlibs_records_generated_total', "Records produced by the built-in generator in this process")
+
+def served(panel, response, outputs):
+    callbacks_served.inc(panel=panel, response=response)
+    return outputs
+
+def store_batch(batch):
+    if history is not None:
+        with timed('store.history'):
+            history.append(batch)
+    with timed('store.buffer'):
+        ad_data.append(batch)
+
+def generate_campaign_data_batch(num_records, seed=None):
+    with timed('producer.generate'):
+        batch = generate_campaign_columns(num_records, seed=seed)
+    store_batch(batch)
+    records_generated.inc(num_records)
+
+# The built-in generator produces ADLIBS_GENERATOR_RATE records a second
+# (default 5 a minute) in batches every ADLIBS_GENERATOR_TICK seconds, with
+# optional bursts; a seed makes the generated stream reproducible.
+GENERATOR_RATE = float(os.environ.get('ADLIBS_GENERATOR_RATE', 5 / 60))
+GENERATOR_TICK = float(os.environ.get('ADLIBS_GENERATOR_TICK', 60))
+GENERATOR_BURSTS = parse_bursts(os.environ.get('ADLIBS_GENERATOR_BURSTS'))
+GENERATOR_SEED = os.environ.get('ADLIBS_GENERATOR_SEED')
 
 def stream_data():
-    while True:
-        generate_campaign_data_batch(5)
-        time.sleep(60)
+    rng = np.random.default_rng(None if GENERATOR_SEED is None else int(GENERATOR_SEED))
+    profile = LoadProfile(GENERATOR_RATE, GENERATOR_BURSTS)
+    for lag, count in paced(schedule(profile, GENERATOR_TICK)):
+        if count:
+            generate_campaign_data_batch(count, seed=rng)
+
+# Real campaign events arrive on POST /api/ingest and are appended in bulk by
+# the producer; with a shared store other workers hand them over on disk.
+INGEST_QUEUE_SIZE = int(os.environ.get('ADLIBS_INGEST_QUEUE_SIZE', 256))
+if SHARED_STORE:
+    ingest_queue = SpoolIngestQueue(store_batch, os.path.join(tempfile.gettempdir(), f"{SHARED_STORE}.ingest"), max_batches=INGEST_QUEUE_SIZE)
+else:
+    ingest_queue = IngestQueue(store_batch, max_batches=INGEST_QUEUE_SIZE)
+
+def forecast_hit_ratio():
+    hits = forecast_requests.value(result='hit')
+    total = hits + forecast_requests.value(result='stale') + forecast_requests.value(result='empty')
+    return hits / total if total else 0.0
+
+# Window gauges are read from the campaign store itself, so with a shared
+# store every worker reports the same totals.
+registry.gauge('adlibs_buffer_records', "Records in the campaign window", lambda: len(ad_data))
+registry.gauge('adlibs_buffer_capacity', "Capacity of the campaign window", lambda: ad_data.capacity)
+registry.gauge('adlibs_buffer_occupancy_ratio', "Fraction of the campaign window in use", lambda: len(ad_data) / ad_data.capacity)
+registry.gauge('adlibs_records_appended_total', "Records appended to the campaign window", lambda: ad_data.version, kind=CounterGauge)
+registry.gauge('adlibs_records_evicted_total', "Records that fell out of the campaign window", lambda: ad_data.version - len(ad_data), kind=CounterGauge)
+registry.gauge('adlibs_ingest_queue_pending', "Ingest batches waiting to be appended", ingest_queue.pending)
+registry.gauge('adlibs_forecast_cache_hit_ratio', "Fraction of forecast lookups served for the current data version", forecast_hit_ratio)
+registry.gauge('adlibs_startup_seconds', "Seconds spent in each startup phase", lambda: [({'phase': name}, seconds) for name, seconds in startup_timings.items()])
+
+# New data versions are pushed to browsers over server-sent events. The
+# forecast version is part of it: a refit finishes after the push for its
+# data, and the forecast panel would otherwise show it one batch late.
+version_notifier = VersionNotifier(lambda: [ad_data.epoch, ad_data.version, forecast_service.version])
+# Open /api/events streams per process (0 for no limit); gunicorn.conf.py
+# sizes it to its thread pool.
+EVENT_STREAM_LIMIT = int(os.environ.get('ADLIBS_EVENT_STREAM_LIMIT', 0))
 
-stream_thread = threading.Thread(target=stream_data, daemon=True)
-stream_thread.start()
+# The producer writes the history; other processes read it, for trend
+# ranges older than the rollups hold.
+history = CampaignHistory(HISTORY_DIR, readonly=True) if HISTORY_DIR and serving_process and not is_producer else None
+producer_started = False
+producer_lock = threading.Lock()
+
+def replay_history(history):
+    # Refills a fresh window with the newest records and the rollups with
+    # the older ones they can hold. The window starts at a timestamp, so
+    # every record reaches the rollups once: older ones here, the rest
+    # through the window's listener. Only the trend looks past the window;
+    # the other panels and the forecast cover the refilled window.
+    recent = history.tail(BUFFER_CAPACITY, columns=('Timestamp',))['Timestamp']
+    if len(recent) == 0:
+        return
+    cutoff = float(recent.min())
+    oldest = float(recent.max()) - max(seconds * slots for seconds, slots in rollups.resolutions.values())
+    with timed('store.replay'):
+        for part in history.scan(('Timestamp',) + rollups.columns, start=oldest, end=cutoff):
+            with ad_data.seqlock.write():
+                rollups.update(part)
+        ad_data.append(history.read(start=cutoff))
+
+def start_producer():
+    # Starts generating data and appending ingested events. Importing this
+    # module has no such side effects; the script entry point and the
+    # gunicorn post_worker_init hook call this once the app is loaded. Only
+    # the producer process writes, and calling it again does nothing.
+    global history, producer_started
+    with producer_lock:
+        if not is_producer or producer_started:
+            return
+        started = time.perf_counter()
+        # With a history directory every batch is also appended to an on-disk
+        # log, which a fresh window and the rollups are refilled from.
+        if HISTORY_DIR:
+            history = CampaignHistory(HISTORY_DIR)
+            if len(ad_data) == 0:
+                replay_history(history)
+        threading.Thread(target=stream_data, daemon=True).start()
+        ingest_queue.start()
+        producer_started = True
+        startup_timings['start_producer'] = time.perf_counter() - started
+
+# Filters for the KPI cards and the aggregate charts:
+# dimension -> (dropdown id, placeholder)
+filter_dimensions = {
+    'AdType': ('filter-adtype', "All ad types"),
+    'Region': ('filter-region', "All regions"),
+    'Device': ('filter-device', "All devices"),
+    'Period': ('filter-period', "All days and times"),
+}
+filter_inputs = [dash.dependencies.Input(component_id, 'value') for component_id, _ in filter_dimensions.values()]
 
 color_schemes = {
     'light': {
@@ -179,10 +319,10 @@ glass_effect_css = {
     
 }
 
-app.layout = html.Div([
+layout = html.Div([
     html.Div([
         html.H1("Ad-Libs: Real-Time Advertising Analytics", className="text-center mb-4"),
-        html.P("Auto-updating dashboard with real-time advertising analytics data (Updates Every 5 minutes).", className="text-center"),
+        html.P("Auto-updating dashboard with real-time advertising analytics data (updates as new data arrives).", className="text-center"),
         html.Div([
             html.Button("Light Theme", id='light-theme-btn', className="btn btn-light btn-sm mx-1"),
             html.Button("Dark Theme", id='dark-theme-btn', className="btn btn-dark btn-sm mx-1"),
@@ -190,6 +330,14 @@ app.layout = html.Div([
     ], id='header', className="p-3"),
     
     html.Div([
+        html.Div([
+            html.Div(
+                dcc.Dropdown(id=component_id, options=categories[dimension], multi=True, placeholder=placeholder),
+                className="col-md-3 mb-2"
+            )
+            for dimension, (component_id, placeholder) in filter_dimensions.items()
+        ], className="row mb-3"),
+
         html.Div([
             html.Div([
                 html.Div([
@@ -231,6 +379,17 @@ app.layout = html.Div([
                 ], className="card-body", id='common-day-card', style=glass_effect_css)
             ], className="card text-center mb-3")
         ], className="d-flex justify-content-around flex-wrap"),
+
+        html.Div([
+            html.Div([
+                html.Div([
+                    html.H4(f"{title} Spread", className="card-title"),
+                    html.P("Median · p95, all campaigns", className="card-text"),
+                    html.H2(id=card_id, className="card-text"),
+                ], className="card-body", id=card_id + '-card', style=glass_effect_css)
+            ], className="card text-center mb-3")
+            for card_id, (title, column, prefix, suffix) in percentile_cards.items()
+        ], className="d-flex justify-content-around flex-wrap"),
         
         html.Div([
             html.Div([
@@ -262,6 +421,13 @@ app.layout = html.Div([
             html.Div([
                 html.Div([
                     html.H4("Revenue Forecast", className="text-center"),
+                    dcc.Dropdown(
+                        id='forecast-segment',
+                        options=[{'label': forecast_segment_label(segment), 'value': segment} for segment in forecast_segments],
+                        value='all',
+                        clearable=False,
+                        className="mb-2"
+                    ),
                     dcc.Graph(id='forecast-plot')
                 ], className="col-md-12 mb-4"),
                 
@@ -271,7 +437,10 @@ app.layout = html.Div([
                         id='download-report-btn',
                         className="btn btn-info btn-lg"
                     ),
-                    dcc.Download(id='download-report')
+                    dcc.Download(id='download-report'),
+                    html.Div(id='report-status', className="mt-2"),
+                    dcc.Interval(id='report-poll', interval=1000, disabled=True),
+                    dcc.Store(id='report-version')
                 ], className="text-center mb-4")
             ], className="row")
 
@@ -279,358 +448,694 @@ app.layout = html.Div([
         ], className="col-md-12")
     ], className="container-fluid"),
 
-    dcc.Interval(
-        id='update-interval',
-        interval=300000,  
-        n_intervals=0
-    )
+    # Set by assets/push.js whenever the server pushes a new data version;
+    # every panel refreshes from it.
+    dcc.Store(id='data-version'),
+
+    dcc.Store(id='theme', data='light', storage_type='session'),
+    dcc.Store(id='color-schemes', data=color_schemes),
+    dcc.Store(id='kpi-version'),
+    dcc.Store(id='charts-version'),
+    dcc.Store(id='trend-version'),
+    dcc.Store(id='region-version'),
+    dcc.Store(id='forecast-version')
 ], id='main-container', className="container-fluid")
 
-@app.callback(
+themed_graphs = ['roas-by-type', 'ctr-by-device', 'metrics-trend', 'region-map', 'top-countries', 'forecast-plot']
+
+def selected_filters(*values):
+    # Dropdown values, in filter_dimensions order, as {dimension: labels}
+    # for the dimensions with a selection.
+    filters = {}
+    for dimension, selected in zip(filter_dimensions, values):
+        if not isinstance(selected, list):
+            selected = [selected]
+        labels = [label for label in categories[dimension] if label in selected]
+        if labels:
+            filters[dimension] = labels
+    return filters
+
+def data_token(filters=None):
+    return [ad_data.epoch, ad_data.version, filters or {}]
+
+def is_up_to_date(rendered_version, filters=None):
+    # Interval ticks re-render a panel only when records arrived since the
+    # version this client last rendered, or its filters changed.
+    return rendered_version == data_token(filters)
+
+# The trend shows at most TREND_POINTS points per trace. It plots the raw
+# records, or per-minute, per-hour or per-day rollups: the finest that holds
+# the visible range in at most TREND_SOURCE_POINTS points, which LTTB then
+# reduces to the budget.
+TREND_POINTS = int(os.environ.get('ADLIBS_TREND_POINTS', 500))
+TREND_SOURCE_POINTS = 10 * TREND_POINTS
+
+def visible_range(relayout):
+    # The x range the user zoomed or panned to, in epoch seconds, or None
+    # for the whole series.
+    if not isinstance(relayout, dict):
+        return None
+    if 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        bounds = [relayout['xaxis.range[0]'], relayout['xaxis.range[1]']]
+    elif 'xaxis.range' in relayout:
+        bounds = relayout['xaxis.range']
+    else:
+        return None
+    try:
+        seconds = [float((np.datetime64(bound, 'us') - np.datetime64(0, 'us')) / np.timedelta64(1, 's')) for bound in bounds]
+    except (TypeError, ValueError):
+        return None
+    # an empty bound parses as NaT
+    return seconds if np.all(np.isfinite(seconds)) else None
+
+def bucket_means(timestamps, columns, seconds=None):
+    # Times and per-column means of the records in each bucket of `seconds`;
+    # without, records are grouped by timestamp. Records of one batch share
+    # a timestamp, so that is one point per batch.
+    keys = timestamps if seconds is None else np.floor(timestamps / seconds) * seconds
+    times, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(times))
+    return times, {
+        column: np.bincount(inverse, weights=columns[column], minlength=len(times)) / counts
+        for column in rollups.columns
+    }
+
+def history_series(start, end, resolution):
+    # The records of [start, end] from the history, or their means per
+    # `resolution` bucket when there are too many.
+    columns = history.read(('Timestamp',) + rollups.columns, start=start, end=end)
+    timestamps = np.asarray(columns['Timestamp'], dtype=np.float64)
+    times, values = bucket_means(timestamps, columns)
+    if len(times) <= TREND_SOURCE_POINTS:
+        return 'records', times, values
+    times, values = bucket_means(timestamps, columns, rollups.resolutions[resolution][0])
+    return resolution, times, values
+
+def trend_series(visible):
+    # Returns (resolution, times, {column: values}) for the visible range.
+    start, end = visible if visible else (None, None)
+    trend_columns = ('Timestamp',) + rollups.columns
+    version, columns = ad_data.snapshot(lambda columns: {name: columns[name].copy() for name in trend_columns})
+    timestamps = columns['Timestamp']
+    # Raw records can only be shown while the window still holds all of the
+    # range, i.e. nothing in it has been evicted.
+    if version == len(timestamps) or (start is not None and len(timestamps) and timestamps.min() <= start):
+        selected = np.ones(len(timestamps), dtype=bool)
+        if start is not None:
+            selected = (timestamps >= start) & (timestamps <= end)
+        times, values = bucket_means(timestamps[selected], {column: columns[column][selected] for column in rollups.columns})
+        if len(times) <= TREND_SOURCE_POINTS:
+            return 'records', times, values
+    # Otherwise the finest rollup still holding the start of the range. When
+    # the one fine enough for the range has been overwritten there, the
+    # range is read back from the history, if there is one.
+    candidates = [name for name in rollups.resolutions if start is None or rollups.covers(name, start)]
+    if history is not None and start is not None:
+        wanted = next((name for name, (seconds, _) in rollups.resolutions.items() if (end - start) / seconds <= TREND_SOURCE_POINTS), None)
+        if wanted is not None and wanted not in candidates:
+            return history_series(start, end, wanted)
+    candidates = candidates or list(rollups.resolutions)[-1:]
+    for name in candidates:
+        times, values = rollups.series(name, start, end)
+        if len(times) <= TREND_SOURCE_POINTS or name == candidates[-1]:
+            return name, times, values
+
+# Plotted values are sent with this many significant digits (0 sends them
+# at full precision), and responses of at least COMPRESSION_MIN_BYTES are
+# compressed with the first of ADLIBS_COMPRESSION the browser accepts.
+PLOT_DIGITS = int(os.environ.get('ADLIBS_PLOT_DIGITS', 6))
+COMPRESSION = [name.strip() for name in os.environ.get('ADLIBS_COMPRESSION', 'br,gzip').split(',') if name.strip() not in ('', 'off')]
+COMPRESSION_MIN_BYTES = int(os.environ.get('ADLIBS_COMPRESSION_MIN_BYTES', 1024))
+COMPRESSION_LEVEL = int(os.environ.get('ADLIBS_COMPRESSION_LEVEL', 5))
+
+def compact(outputs):
+    with timed('render.compact'):
+        return compact_outputs(outputs, PLOT_DIGITS)
+
+# Rendered panel outputs by panel, response, data token and theme. A new
+# version is pushed to every browser at once, and all of them showing the
+# same selection are answered from a single render.
+RENDER_CACHE_SIZE = int(os.environ.get('ADLIBS_RENDER_CACHE_SIZE', 256))
+render_cache = OrderedDict()
+render_lock = threading.Lock()
+render_requests = registry.counter('adlibs_render_cache_requests_total', "Panel renders looked up in the render cache by result")
+
+def cached_render(key, render):
+    key = json.dumps(key)
+    with render_lock:
+        outputs = render_cache.get(key)
+        if outputs is not None:
+            render_cache.move_to_end(key)
+    if outputs is not None:
+        render_requests.inc(result='hit')
+        return outputs
+    render_requests.inc(result='miss')
+    # Rendered outside the lock; concurrent misses for the same key may
+    # render twice, which is harmless.
+    outputs = compact(render())
+    with render_lock:
+        render_cache[key] = outputs
+        if len(render_cache) > RENDER_CACHE_SIZE:
+            render_cache.popitem(last=False)
+    return outputs
+
+def can_patch(rendered_version):
+    # Whether the client's figures can be patched in place: the patches
+    # replace every trace's values, so any number of new records fits. A
+    # first render or data from another run needs full figures.
+    if not rendered_version or rendered_version[0] != ad_data.epoch or rendered_version[1] == 0:
+        return False
+    return ad_data.version > rendered_version[1]
+
+# The region map always shows the same regions, so its trace and geo layout
+# are built once per theme; renders only fill in the click counts.
+region_locations = [region_iso3[region] for region in regions]
+region_map_bases = {}
+
+def region_map_base(theme):
+    if theme not in region_map_bases:
+        region_map = go.Figure(go.Choropleth(
+            locations=region_locations,
+            locationmode='ISO-3',
+            text=regions,
+            z=[None] * len(regions),
+            colorscale='Tealgrn',
+            colorbar_title='Clicks',
+            hovertemplate='%{text}<br>Clicks=%{z}<extra></extra>'
+        ))
+        region_map.update_layout(
+            plot_bgcolor=color_schemes[theme]['plot_bg'],
+            paper_bgcolor=color_schemes[theme]['paper_bg'],
+            font_color=color_schemes[theme]['text'],
+            geo=dict(
+                showframe=False,
+                showcoastlines=True,
+                projection_type='equirectangular',
+                bgcolor=color_schemes[theme]['plot_bg']
+            )
+        )
+        # Only ship the parts of the default template a choropleth uses;
+        # the full template is most of the figure's size.
+        template = region_map.layout.template
+        region_map.update_layout(template=go.layout.Template(
+            layout={key: template.layout[key] for key in ('font', 'geo', 'hoverlabel', 'title')},
+            data={'choropleth': template.data.choropleth}
+        ))
+        region_map_bases[theme] = region_map.to_plotly_json()
+    return region_map_bases[theme]
+
+def region_map_values(filters=None):
+    # Regions without matching records are left blank on the map.
+    clicks = aggregates.group_metric('Region', 'Clicks', filters)
+    return [None if np.isnan(value) else float(value) for value in clicks]
+
+def empty_figure(theme):
+    empty_fig = go.Figure()
+    empty_fig.update_layout(
+        plot_bgcolor=color_schemes[theme]['plot_bg'],
+        paper_bgcolor=color_schemes[theme]['paper_bg']
+    )
+    return empty_fig
+
+def percentile_values():
+    values = []
+    for title, column, prefix, suffix in percentile_cards.values():
+        median, p95 = sketches.quantiles(column, (0.5, 0.95))
+        values.append(f"{prefix}{median:,.2f}{suffix} · {prefix}{p95:,.2f}{suffix}")
+    return values
+
+def refresh_kpis(filters):
+    # Returns the (current, previous) KPIs for a filter selection. They are
+    # answered from cube slices, with the ratios taken over the slice's sums.
+    key = json.dumps(filters, sort_keys=True)
+    with kpi_lock:
+        version = ad_data.version
+        cached = kpi_cache.get(key)
+        if cached is not None:
+            kpi_cache.move_to_end(key)
+            if cached[0] == version:
+                return cached[1], cached[2]
+        current = {
+            'rpc': f"${aggregates.metric('RPC', filters):.2f}",
+            'ctr': f"{aggregates.metric('CTR', filters):.2f}%",
+            'cpc': f"${aggregates.metric('CPC', filters):.2f}",
+            'cpa': f"${aggregates.metric('CPA', filters):.2f}",
+            'peak': aggregates.mode('Period', filters) or 'N/A',
+            'percentiles': percentile_values()
+        }
+        previous = cached[1] if cached is not None else empty_kpis
+        kpi_cache[key] = (version, current, previous)
+        if len(kpi_cache) > KPI_CACHE_SIZE:
+            kpi_cache.popitem(last=False)
+        return current, previous
+
+# Theme switching runs entirely in the browser (assets/theme.js) and the
+# choice is kept per browser session in the 'theme' store.
+dash.clientside_callback(
+    dash.ClientsideFunction(namespace='theme', function_name='select'),
+    dash.dependencies.Output('theme', 'data'),
+    [
+        dash.dependencies.Input('light-theme-btn', 'n_clicks'),
+        dash.dependencies.Input('dark-theme-btn', 'n_clicks')
+    ],
+    prevent_initial_call=True
+)
+
+dash.clientside_callback(
+    dash.ClientsideFunction(namespace='theme', function_name='apply'),
+    [
+        dash.dependencies.Output('header', 'style'),
+        dash.dependencies.Output('main-container', 'style'),
+    ] + [
+        dash.dependencies.Output(graph_id, 'figure', allow_duplicate=True)
+        for graph_id in themed_graphs
+    ],
+    [
+        dash.dependencies.Input('theme', 'data')
+    ],
+    [
+        dash.dependencies.State('color-schemes', 'data')
+    ] + [
+        dash.dependencies.State(graph_id, 'figure')
+        for graph_id in themed_graphs
+    ],
+    prevent_initial_call='initial_duplicate'
+)
+
+@dash.callback(
     [
         dash.dependencies.Output('rpc', 'children'),
         dash.dependencies.Output('avg-ctr', 'children'),
         dash.dependencies.Output('avg-cpc', 'children'),
         dash.dependencies.Output('common-peak', 'children'),
-        dash.dependencies.Output('avg-cpa', 'children'),
+        dash.dependencies.Output('avg-cpa', 'children')
+    ] + [
+        dash.dependencies.Output(card_id, 'children')
+        for card_id in percentile_cards
+    ] + [
+        dash.dependencies.Output('kpi-version', 'data')
+    ],
+    [
+        dash.dependencies.Input('data-version', 'data')
+    ] + filter_inputs,
+    [
+        dash.dependencies.State('theme', 'data'),
+        dash.dependencies.State('kpi-version', 'data')
+    ]
+)
+def update_kpis(data_version, filter_ad_types, filter_regions, filter_devices, filter_periods, theme, rendered_version):
+    filters = selected_filters(filter_ad_types, filter_regions, filter_devices, filter_periods)
+    if is_up_to_date(rendered_version, filters):
+        return served('kpis', 'unchanged', [dash.no_update] * (6 + len(percentile_cards)))
+
+    if len(ad_data) == 0:
+        return served('kpis', 'empty', ['$0', '0%', '$0', 'N/A', '$0'] + ['N/A'] * len(percentile_cards) + [data_token(filters)])
+
+    with timed('kpis.aggregates'):
+        current_kpis, previous_kpis = refresh_kpis(filters)
+
+    return served('kpis', 'full', [
+        format_kpi_value(current_kpis['rpc'], previous_kpis['rpc'], prefix='$'),
+        format_kpi_value(current_kpis['ctr'], previous_kpis['ctr'], suffix='%'),
+        format_kpi_value(current_kpis['cpc'], previous_kpis['cpc'], prefix='$'),
+        current_kpis['peak'],
+        format_kpi_value(current_kpis['cpa'], previous_kpis['cpa'], prefix='$')
+    ] + current_kpis['percentiles'] + [
+        data_token(filters)
+    ])
+
+@dash.callback(
+    [
         dash.dependencies.Output('roas-by-type', 'figure'),
         dash.dependencies.Output('ctr-by-device', 'figure'),
-        dash.dependencies.Output('metrics-trend', 'figure'),
-        dash.dependencies.Output('region-map', 'figure'),
-        dash.dependencies.Output('top-countries', 'figure'),
-        dash.dependencies.Output('forecast-plot', 'figure'),
-        dash.dependencies.Output('header', 'style'),
-        dash.dependencies.Output('main-container', 'style'),
-        dash.dependencies.Output('rpc-card', 'style'),
-        dash.dependencies.Output('avg-ctr-card', 'style'),
-        dash.dependencies.Output('avg-cpc-card', 'style'),
-        dash.dependencies.Output('common-day-card', 'style'),
-        dash.dependencies.Output('avg-cpa-card', 'style')        
+        dash.dependencies.Output('charts-version', 'data')
     ],
     [
-        dash.dependencies.Input('update-interval', 'n_intervals'),
-        dash.dependencies.Input('light-theme-btn', 'n_clicks'),
-        dash.dependencies.Input('dark-theme-btn', 'n_clicks'),
-        dash.dependencies.Input('download-report-btn', 'n_clicks')
+        dash.dependencies.Input('data-version', 'data')
+    ] + filter_inputs,
+    [
+        dash.dependencies.State('theme', 'data'),
+        dash.dependencies.State('charts-version', 'data')
     ]
 )
-def update_dashboard(n_interval, light_clicks, dark_clicks, download_clicks):
-    global previous_kpis, current_theme
-    
-    if dash_ctx.triggered_id:
-        if dash_ctx.triggered_id == 'light-theme-btn':
-            current_theme = 'light'
-        elif dash_ctx.triggered_id == 'dark-theme-btn':
-            current_theme = 'dark'
-    
+def update_charts(data_version, filter_ad_types, filter_regions, filter_devices, filter_periods, theme, rendered_version):
+    filters = selected_filters(filter_ad_types, filter_regions, filter_devices, filter_periods)
+    if is_up_to_date(rendered_version, filters):
+        return served('charts', 'unchanged', [dash.no_update] * 3)
+
     if len(ad_data) == 0:
-        empty_fig = go.Figure()
-        empty_fig.update_layout(
-            plot_bgcolor=color_schemes[current_theme]['plot_bg'],
-            paper_bgcolor=color_schemes[current_theme]['paper_bg']
-        )
-        return ['$0', '0%', '$0', 'N/A', '$0'] + [empty_fig] * 5 + [
-            {'backgroundColor': color_schemes[current_theme]['background'], 'color': color_schemes[current_theme]['text']},
-            {'backgroundColor': color_schemes[current_theme]['background'], 'color': color_schemes[current_theme]['text']},
-        ]
+        return served('charts', 'empty', [empty_figure(theme)] * 2 + [data_token(filters)])
 
-    df = pd.DataFrame(ad_data)
-    
-    rpc = f"${df['RPC'].mean():.2f}"
-    avg_ctr = f"{df['CTR'].mean():.2f}%"
-    avg_cpc = f"${df['CPC'].mean():.2f}"
-    common_peak = df['Period'].mode()[0]
-    avg_cpa = f"${df['CPA'].mean():.2f}"
-
-    rpc_kpi = format_kpi_value(rpc, previous_kpis['rpc'], prefix='$')
-    ctr_kpi = format_kpi_value(avg_ctr, previous_kpis['ctr'], suffix='%')
-    cpc_kpi = format_kpi_value(avg_cpc, previous_kpis['cpc'], prefix='$')
-    cpa_kpi = format_kpi_value(avg_cpa, previous_kpis['cpa'], prefix='$')
-
-    previous_kpis = {
-        'rpc': rpc,
-        'ctr': avg_ctr,
-        'cpc': avg_cpc,
-        'cpa': avg_cpa
-    }
+    token = data_token(filters)
+    response = 'patch' if can_patch(rendered_version) else 'full'
+    outputs = cached_render(['charts', response, token, theme], lambda: render_charts(filters, theme, response == 'patch'))
+    return served('charts', response, outputs + [token])
 
+def render_charts(filters, theme, patch):
+    with timed('charts.aggregates'):
+        roas_labels, roas_values = aggregates.groups('AdType', 'ROAS', filters)
+        ctr_labels, ctr_values = aggregates.groups('Device', 'CTR', filters)
+
+    if patch:
+        # Patch only the changed bar and pie values.
+        patch_started = time.perf_counter()
+        roas_by_type = dash.Patch()
+        roas_by_type['data'][0]['x'] = roas_labels
+        roas_by_type['data'][0]['y'] = roas_values
+
+        ctr_by_device = dash.Patch()
+        ctr_by_device['data'][0]['labels'] = ctr_labels
+        ctr_by_device['data'][0]['values'] = ctr_values
+
+        observe_stage('charts.patch', patch_started)
+        return [roas_by_type, ctr_by_device]
+
+    figures_started = time.perf_counter()
     roas_by_type = go.Figure(data=[
         go.Bar(
-            x=df.groupby('AdType')['ROAS'].mean().index,
-            y=df.groupby('AdType')['ROAS'].mean().values,
-            marker_color=px.colors.sequential.Tealgrn
+            x=roas_labels,
+            y=roas_values,
+            marker_color=sequential.Tealgrn
         )
     ])
     
     roas_by_type.update_layout(
-        plot_bgcolor=color_schemes[current_theme]['plot_bg'],
-        paper_bgcolor=color_schemes[current_theme]['paper_bg'],
-        font_color=color_schemes[current_theme]['text'],
+        plot_bgcolor=color_schemes[theme]['plot_bg'],
+        paper_bgcolor=color_schemes[theme]['paper_bg'],
+        font_color=color_schemes[theme]['text'],
         title="Average ROAS by Ad Type"
     )
 
     ctr_by_device = go.Figure(data=[
         go.Pie(
-            labels=df.groupby('Device')['CTR'].mean().index,
-            values=df.groupby('Device')['CTR'].mean().values,
-            marker_colors=px.colors.sequential.Tealgrn,
+            labels=ctr_labels,
+            values=ctr_values,
+            marker_colors=sequential.Tealgrn,
             textinfo='label+percent'
         )
     ])
 
     ctr_by_device.update_layout(
-        plot_bgcolor=color_schemes[current_theme]['plot_bg'],
-        paper_bgcolor=color_schemes[current_theme]['paper_bg'],
-        font_color=color_schemes[current_theme]['text'],
+        plot_bgcolor=color_schemes[theme]['plot_bg'],
+        paper_bgcolor=color_schemes[theme]['paper_bg'],
+        font_color=color_schemes[theme]['text'],
         title="CTR by Device"
     )
 
+    observe_stage('charts.figures', figures_started)
+    return [roas_by_type, ctr_by_device]
+
+@dash.callback(
+    [
+        dash.dependencies.Output('metrics-trend', 'figure'),
+        dash.dependencies.Output('trend-version', 'data')
+    ],
+    [
+        dash.dependencies.Input('data-version', 'data'),
+        dash.dependencies.Input('metrics-trend', 'relayoutData')
+    ],
+    [
+        dash.dependencies.State('theme', 'data'),
+        dash.dependencies.State('trend-version', 'data')
+    ]
+)
+def update_trend(data_version, relayout, theme, rendered_version):
+    # Re-rendered for new records and whenever the visible range changes.
+    # The trend is not filtered; it covers the stream by time, including
+    # records that already left the window.
+    visible = visible_range(relayout)
+    token = data_token({'range': visible} if visible else None)
+    if rendered_version == token:
+        return served('trend', 'unchanged', [dash.no_update] * 2)
+
+    if len(ad_data) == 0:
+        return served('trend', 'empty', [empty_figure(theme), token])
+
+    return served('trend', 'full', cached_render(['trend', token, theme], lambda: render_trend(visible, theme)) + [token])
+
+def render_trend(visible, theme):
+    with timed('trend.series'):
+        resolution, times, values = trend_series(visible)
+
+    figures_started = time.perf_counter()
     metrics_trend = go.Figure()
-    metrics_trend.add_trace(go.Scatter(
-        x=df.index,
-        y=df['ConversionRate'],
-        name='Conversion Rate',
-        mode='lines+markers',
-        line=dict(color=px.colors.sequential.Tealgrn[0])
-    ))
-    
-    metrics_trend.add_trace(go.Scatter(
-        x=df.index,
-        y=df['BounceRate'],
-        name='Bounce Rate',
-        mode='lines+markers',
-        line=dict(color=px.colors.sequential.Tealgrn[1])
-    ))
+    for column, name, color in [('ConversionRate', 'Conversion Rate', sequential.Tealgrn[0]),
+                                ('BounceRate', 'Bounce Rate', sequential.Tealgrn[1])]:
+        kept = lttb(times, values[column], TREND_POINTS)
+        metrics_trend.add_trace(go.Scatter(
+            x=(times[kept] * 1e3).astype(np.int64).astype('datetime64[ms]'),
+            y=values[column][kept],
+            name=name,
+            mode='lines+markers',
+            line=dict(color=color)
+        ))
 
     metrics_trend.update_layout(
-        plot_bgcolor=color_schemes[current_theme]['plot_bg'],
-        paper_bgcolor=color_schemes[current_theme]['paper_bg'],
-        font_color=color_schemes[current_theme]['text'],
-        title="Conversion and Bounce Rate Trends",
-        xaxis_title="Data Points",
-        yaxis_title="Rate (%)"
+        plot_bgcolor=color_schemes[theme]['plot_bg'],
+        paper_bgcolor=color_schemes[theme]['paper_bg'],
+        font_color=color_schemes[theme]['text'],
+        title="Conversion and Bounce Rate Trends" + ("" if resolution == 'records' else f" (per {resolution})"),
+        xaxis_title="Time (UTC)",
+        yaxis_title="Rate (%)",
+        # keeps the user's zoom when new data is rendered
+        uirevision='metrics-trend'
     )
 
-    region_map = px.choropleth(
-        df.groupby('Region')['Clicks'].sum().reset_index(),
-        locations='Region',
-        locationmode='country names',
-        color='Clicks',
-        color_continuous_scale='Tealgrn',
-        projection='natural earth'
-    )
+    observe_stage('trend.figures', figures_started)
+    return [metrics_trend]
 
-    region_map.update_layout(
-        plot_bgcolor=color_schemes[current_theme]['plot_bg'],
-        paper_bgcolor=color_schemes[current_theme]['paper_bg'],
-        font_color=color_schemes[current_theme]['text'],
-        geo=dict(
-            showframe=False,
-            showcoastlines=True,
-            projection_type='equirectangular',
-            bgcolor=color_schemes[current_theme]['plot_bg']
-        )
-    )
+@dash.callback(
+    [
+        dash.dependencies.Output('region-map', 'figure'),
+        dash.dependencies.Output('top-countries', 'figure'),
+        dash.dependencies.Output('region-version', 'data')
+    ],
+    [
+        dash.dependencies.Input('data-version', 'data')
+    ] + filter_inputs,
+    [
+        dash.dependencies.State('theme', 'data'),
+        dash.dependencies.State('region-version', 'data')
+    ]
+)
+def update_region_charts(data_version, filter_ad_types, filter_regions, filter_devices, filter_periods, theme, rendered_version):
+    filters = selected_filters(filter_ad_types, filter_regions, filter_devices, filter_periods)
+    if is_up_to_date(rendered_version, filters):
+        return served('region', 'unchanged', [dash.no_update] * 3)
+
+    if len(ad_data) == 0:
+        return served('region', 'empty', [empty_figure(theme)] * 2 + [data_token(filters)])
+
+    token = data_token(filters)
+    response = 'patch' if can_patch(rendered_version) else 'full'
+    outputs = cached_render(['region', response, token, theme], lambda: render_region_charts(filters, theme, response == 'patch'))
+    return served('region', response, outputs + [token])
+
+def render_region_charts(filters, theme, patch):
+    with timed('region.aggregates'):
+        region_clicks = region_map_values(filters)
+        top_labels, top_clicks = aggregates.top_k('Region', 'Clicks', 5, filters)
+
+    if patch:
+        region_map = dash.Patch()
+        region_map['data'][0]['z'] = region_clicks
+
+        top_countries = dash.Patch()
+        top_countries['data'][0]['x'] = top_clicks
+        top_countries['data'][0]['y'] = top_labels
+
+        return [region_map, top_countries]
+
+    figures_started = time.perf_counter()
+    base = region_map_base(theme)
+    region_map = {'data': [dict(base['data'][0], z=region_clicks)], 'layout': base['layout']}
 
     top_countries = go.Figure(data=[
         go.Bar(
-            x=df.groupby('Region')['Clicks'].sum().nlargest(5).values,
-            y=df.groupby('Region')['Clicks'].sum().nlargest(5).index,
+            x=top_clicks,
+            y=top_labels,
             orientation='h',
-            marker_color=px.colors.sequential.Tealgrn[0]
+            marker_color=sequential.Tealgrn[0]
         )
     ])
 
     top_countries.update_layout(
-        plot_bgcolor=color_schemes[current_theme]['plot_bg'],
-        paper_bgcolor=color_schemes[current_theme]['paper_bg'],
-        font_color=color_schemes[current_theme]['text'],
+        plot_bgcolor=color_schemes[theme]['plot_bg'],
+        paper_bgcolor=color_schemes[theme]['paper_bg'],
+        font_color=color_schemes[theme]['text'],
         title="Top 5 Countries by Clicks",
         height=300
     )
 
-    forecast_data = pd.DataFrame({
-        'ds': pd.date_range(start='2024-01-01', periods=len(df), freq='D'),
-        'y': df['Revenue']
-    })
-    
-    model = Prophet(yearly_seasonality=True, weekly_seasonality=True)
-    model.fit(forecast_data)
-    
-    future_dates = model.make_future_dataframe(periods=30)
-    forecast = model.predict(future_dates)
-    
+    observe_stage('region.figures', figures_started)
+    return [region_map, top_countries]
+
+@dash.callback(
+    [
+        dash.dependencies.Output('forecast-plot', 'figure'),
+        dash.dependencies.Output('forecast-version', 'data')
+    ],
+    [
+        dash.dependencies.Input('data-version', 'data'),
+        dash.dependencies.Input('forecast-segment', 'value')
+    ],
+    [
+        dash.dependencies.State('theme', 'data'),
+        dash.dependencies.State('forecast-version', 'data')
+    ]
+)
+def update_forecast(data_version, segment, theme, rendered_version):
+    if len(ad_data) == 0:
+        return served('forecast', 'empty', [empty_figure(theme), None])
+    if segment not in forecast_segments:
+        segment = 'all'
+
+    # Serves the last fitted forecast straight away; a refit for newer data
+    # runs in the background and shows up on a later refresh.
+    result = forecast_service.get(ad_data.version, segment=segment, timeout=FORECAST_FIRST_FIT_TIMEOUT)
+    if result is None:
+        token = None
+    else:
+        token = [ad_data.epoch, result.version, len(result.history), segment]
+    if rendered_version is not None and rendered_version == token:
+        return served('forecast', 'unchanged', [dash.no_update] * 2)
+
+    if token is not None and rendered_version is not None and [rendered_version[0]] + rendered_version[2:] == [token[0]] + token[2:]:
+        # Same number of points on the same dates: only the values moved.
+        forecast = result.forecast
+        forecast_plot = dash.Patch()
+        forecast_plot['data'][0]['y'] = result.history
+        forecast_plot['data'][1]['y'] = forecast['yhat']
+        forecast_plot['data'][2]['y'] = forecast['yhat_upper']
+        forecast_plot['data'][3]['y'] = forecast['yhat_lower']
+        return served('forecast', 'patch', compact([forecast_plot]) + [token])
+
+    figures_started = time.perf_counter()
     forecast_plot = go.Figure()
-    forecast_plot.add_trace(go.Scatter(
-        x=forecast['ds'][:len(df)],
-        y=df['Revenue'],
-        name='Historical Revenue',
-        line_color='rgba(0,100,80,0.5)',
-        mode='lines+markers'
-    ))
-    
-    forecast_plot.add_trace(go.Scatter(
-        x=forecast['ds'],
-        y=forecast['yhat'],
-        name='Forecast',
-        mode='lines',
-        line_color='rgba(0,150,0,0.8)',
-        line=dict(dash='dot')
-    ))
-    
-    forecast_plot.add_trace(go.Scatter(
-        x=forecast['ds'],
-        y=forecast['yhat_upper'],
-        fill=None,
-        mode='lines',
-        line_color='rgba(0,100,80,0.2)',
-        name='Upper Bound'
-    ))
-    
-    forecast_plot.add_trace(go.Scatter(
-        x=forecast['ds'],
-        y=forecast['yhat_lower'],
-        fill='tonexty',
-        mode='lines',
-        line_color='rgba(0,100,80,0.2)',
-        name='Lower Bound'
-    ))
-    
+    if result is None:
+        revenue = ad_data.snapshot(lambda columns: segment_revenue(columns, segment))[1]
+        forecast_plot.add_trace(go.Scatter(
+            x=forecast_dates(len(revenue)),
+            y=revenue,
+            name='Historical Revenue',
+            line_color='rgba(0,100,80,0.5)',
+            mode='lines+markers'
+        ))
+    else:
+        forecast = result.forecast
+        forecast_plot.add_trace(go.Scatter(
+            x=forecast['ds'][:len(result.history)],
+            y=result.history,
+            name='Historical Revenue',
+            line_color='rgba(0,100,80,0.5)',
+            mode='lines+markers'
+        ))
+
+        forecast_plot.add_trace(go.Scatter(
+            x=forecast['ds'],
+            y=forecast['yhat'],
+            name='Forecast',
+            mode='lines',
+            line_color='rgba(0,150,0,0.8)',
+            line=dict(dash='dot')
+        ))
+
+        forecast_plot.add_trace(go.Scatter(
+            x=forecast['ds'],
+            y=forecast['yhat_upper'],
+            fill=None,
+            mode='lines',
+            line_color='rgba(0,100,80,0.2)',
+            name='Upper Bound'
+        ))
+
+        forecast_plot.add_trace(go.Scatter(
+            x=forecast['ds'],
+            y=forecast['yhat_lower'],
+            fill='tonexty',
+            mode='lines',
+            line_color='rgba(0,100,80,0.2)',
+            name='Lower Bound'
+        ))
+
     forecast_plot.update_layout(
-        plot_bgcolor=color_schemes[current_theme]['plot_bg'],
-        paper_bgcolor=color_schemes[current_theme]['paper_bg'],
-        font_color=color_schemes[current_theme]['text'],
-        title="Revenue Forecast (30 Days)"
+        plot_bgcolor=color_schemes[theme]['plot_bg'],
+        paper_bgcolor=color_schemes[theme]['paper_bg'],
+        font_color=color_schemes[theme]['text'],
+        title=f"Revenue Forecast (30 Days): {forecast_segment_label(segment)}"
     )
 
-    return [
-        rpc_kpi,
-        ctr_kpi,
-        cpc_kpi,
-        common_peak,
-        cpa_kpi,
-        roas_by_type,
-        ctr_by_device,
-        metrics_trend,
-        region_map,
-        top_countries,
-        forecast_plot,
-        {'backgroundColor': color_schemes[current_theme]['background'], 'color': color_schemes[current_theme]['text']},
-        {'backgroundColor': color_schemes[current_theme]['background'], 'color': color_schemes[current_theme]['text']},
-        glass_effect_css,
-        glass_effect_css,
-        glass_effect_css,
-        glass_effect_css,
-        glass_effect_css
-    ]
+    observe_stage('forecast.figure', figures_started)
+    return served('forecast', 'full', compact([forecast_plot]) + [token])
 
-@app.callback(
-    dash.dependencies.Output('download-report', 'data'),
+@dash.callback(
+    [
+        dash.dependencies.Output('download-report', 'data'),
+        dash.dependencies.Output('report-version', 'data'),
+        dash.dependencies.Output('report-poll', 'disabled'),
+        dash.dependencies.Output('report-status', 'children')
+    ],
     dash.dependencies.Input('download-report-btn', 'n_clicks'),
     prevent_initial_call=True
 )
-
-def generate_report(n_clicks):
+def request_report(n_clicks):
     if n_clicks is None:
-        return dash.no_update
-    
-    df = pd.DataFrame(ad_data)
-    
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    styles = getSampleStyleSheet()
-    story = []
-    
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        spaceAfter=30,
-        textColor=colors.HexColor("#2E4053")
-    )
-    story.append(Paragraph("Ad Performance Report", title_style))
-    story.append(Spacer(1, 12))
-    
-    last_updated = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    story.append(Paragraph(f"Last Updated: {last_updated}", styles['Normal']))
-    story.append(Spacer(1, 12))
-    
-    key_metrics_style = ParagraphStyle(
-        'KeyMetrics',
-        parent=styles['Heading2'],
-        fontSize=18,
-        spaceAfter=20,
-        textColor=colors.HexColor("#2874A6")
-    )
-    story.append(Paragraph("Key Metrics", key_metrics_style))
-    story.append(Spacer(1, 12))
-
-    metrics = [
-        ["Metric", "Value"],
-        ["Average Revenue", f"${df['Revenue'].mean():.2f}"],
-        ["Average CTR", f"{df['CTR'].mean():.2f}%"],
-        ["Average CPC", f"${df['CPC'].mean():.2f}"],
-        ["Average ROAS", f"{df['ROAS'].mean():.2f}"],
-        ["Total Conversions", f"{df['Conversions'].sum()}"],
-        ["Total Impressions", f"{df['Impressions'].sum()}"],
-        ["Total Clicks", f"{df['Clicks'].sum()}"],
-        ["Total Spend", f"${df['Spend'].sum():.2f}"]
-    ]
-    
-    table = Table(metrics)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#1ABC9C")),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 14),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor("#A9DFBF")),
-        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    story.append(table)
-    story.append(Spacer(1, 12))
-    
+        return [dash.no_update] * 4
+    return report_response(time.time())
 
-    def add_plot_to_story(df, x, y, title, story):
-        fig, ax = plt.subplots(figsize=(6, 4))
-        sns.barplot(x=x, y=y, data=df, ax=ax, palette="Greens_d")
-        ax.set_title(title, fontsize=14, color="#2E4053")
-        ax.set_xlabel(x, fontsize=12, color="#2E4053")
-        ax.set_ylabel(y, fontsize=12, color="#2E4053")
-        plt.tight_layout()
-        imgdata = io.BytesIO()
-        fig.savefig(imgdata, format='png')
-        imgdata.seek(0)
-        story.append(Image(imgdata, width=400, height=300))
-        story.append(Spacer(1, 12))
-    
-    add_plot_to_story(df, 'AdType', 'ROAS', 'Average ROAS by Ad Type', story)
-    add_plot_to_story(df, 'Device', 'CTR', 'Average CTR by Device', story)
-    add_plot_to_story(df, 'Region', 'Clicks', 'Clicks by Region', story)
-    
-    fig, ax = plt.subplots(figsize=(6, 4))
-    sns.lineplot(x=df.index, y='Revenue', data=df, ax=ax, color="green")
-    ax.set_title('Revenue Forecast', fontsize=14, color="#2E4053")
-    ax.set_xlabel('Date', fontsize=12, color="#2E4053")
-    ax.set_ylabel('Revenue', fontsize=12, color="#2E4053")
-    plt.tight_layout()
-    imgdata = io.BytesIO()
-    fig.savefig(imgdata, format='png')
-    imgdata.seek(0)
-    story.append(Image(imgdata, width=400, height=300))
-    story.append(Spacer(1, 12))
-    
-    doc.build(story)
-    buffer.seek(0)
-    
-    return dcc.send_bytes(
-        buffer.getvalue(),
-        filename=f"ad_performance_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    )
+@dash.callback(
+    [
+        dash.dependencies.Output('download-report', 'data', allow_duplicate=True),
+        dash.dependencies.Output('report-version', 'data', allow_duplicate=True),
+        dash.dependencies.Output('report-poll', 'disabled', allow_duplicate=True),
+        dash.dependencies.Output('report-status', 'children', allow_duplicate=True)
+    ],
+    dash.dependencies.Input('report-poll', 'n_intervals'),
+    dash.dependencies.State('report-version', 'data'),
+    prevent_initial_call=True
+)
+def poll_report(n_intervals, requested_at):
+    if requested_at is None:
+        return [dash.no_update, dash.no_update, True, '']
+    return report_response(requested_at, start=False)
+
+def report_response(requested_at, start=True):
+    # The PDF is built in the background; until it is ready the browser polls
+    # with 'report-poll' instead of holding the request open. The browser
+    # keeps the request time, which means the same to every worker.
+    status, result = report_service.request(requested_at, ad_data.version, start=start)
+    if status == 'done':
+        pdf, filename = result
+        return [dcc.send_bytes(pdf, filename=filename), None, True, '']
+    if status == 'failed':
+        return [dash.no_update, None, True, f"Report failed: {result}"]
+    return [dash.no_update, requested_at, False, "Preparing report..."]
+
+def create_app():
+    # Application factory: builds the Dash app around the module's data
+    # store. Callbacks are registered globally with dash.callback and are
+    # picked up by every app created here.
+    started = time.perf_counter()
+    app = dash.Dash(__name__, external_stylesheets=['https://cdn.jsdelivr.net/npm/bootstrap@5.2.3/dist/css/bootstrap.min.css'])
+    app.title = "Ad-Libs"
+    app.layout = layout
+    register_ingest_route(app.server, ingest_queue)
+    register_metrics_route(app.server)
+    register_events_route(app.server, version_notifier, limit=EVENT_STREAM_LIMIT)
+    # after the metrics route, so that its request metrics see the
+    # compressed size
+    register_compression(app.server, COMPRESSION, COMPRESSION_MIN_BYTES, COMPRESSION_LEVEL)
+    startup_timings['create_app'] = time.perf_counter() - started
+    return app
+
+def startup_report():
+    return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in startup_timings.items())
+
+app = create_app()
+server = app.server
+startup_timings['import'] = time.perf_counter() - import_started
 
 if __name__ == '__main__':
+    start_producer()
+    print(f"Ad-Libs started: {startup_report()}")
     app.run_server(debug=True, port=8050)
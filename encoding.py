@@ -0,0 +1,110 @@
+import gzip
+import numbers
+from datetime import date
+
+import numpy as np
+from dash import Patch
+from flask import request
+from plotly.basedatatypes import BaseFigure
+
+from metrics import registry
+
+# Smaller and faster callback responses. Plotted values are rounded to a
+# number of significant digits and kept as NumPy arrays, which Dash's JSON
+# encoder (orjson through plotly when installed) writes in one pass instead
+# of element by element; dates lose their empty time of day. Responses are
+# then compressed with brotli (when installed) or gzip.
+
+compressed_responses = registry.counter('adlibs_compressed_responses_total', "Responses compressed by encoding")
+
+
+def round_significant(values, digits):
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitude = np.floor(np.log10(np.abs(values)))
+        scale = np.where(np.isfinite(magnitude), 10.0 ** (digits - 1 - magnitude), 1.0)
+        rounded = np.round(values * scale) / scale
+    return np.where(np.isfinite(rounded), rounded, values)
+
+
+def compact_array(values, digits):
+    # Numbers as a (rounded) NumPy array, dates as the shortest ISO
+    # strings; anything else, e.g. labels or values with gaps, is returned
+    # unchanged.
+    array = values if isinstance(values, np.ndarray) else None
+    first = values[0]
+    if array is None and isinstance(first, numbers.Number) and not isinstance(first, bool):
+        array = np.asarray(values)
+    if array is not None and array.dtype.kind == 'O' and isinstance(first, (date, np.datetime64)):
+        import pandas as pd
+        try:
+            array = pd.DatetimeIndex(array).values
+        except (TypeError, ValueError):
+            return values
+    if array is None:
+        return values
+    if array.dtype.kind == 'f':
+        return round_significant(array, digits) if digits else array
+    if array.dtype.kind in 'iub':
+        return array
+    if array.dtype.kind == 'M':
+        return np.datetime_as_string(array, unit='auto')
+    return values
+
+
+def compact(value, digits):
+    if isinstance(value, (BaseFigure, Patch)):
+        value = value.to_plotly_json()
+    if isinstance(value, dict):
+        # the theme template carries no data and is left as it is
+        return {key: item if key == 'template' else compact(item, digits) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)) and len(value):
+        compacted = compact_array(value, digits)
+        if compacted is not value:
+            return compacted
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        return [compact(item, digits) for item in value]
+    return value
+
+
+def compact_outputs(outputs, digits):
+    # Callback outputs with figures and patches made compact.
+    return [compact(output, digits) for output in outputs]
+
+
+def brotli_compressor():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return lambda data, level: brotli.compress(data, quality=level)
+
+
+def register_compression(server, encodings=('br', 'gzip'), min_bytes=1024, level=5):
+    # Compresses responses with the first of `encodings` the client accepts.
+    # Streams such as /api/events are never buffered.
+    compressors = {'gzip': lambda data, level: gzip.compress(data, compresslevel=level)}
+    brotli_compress = brotli_compressor()
+    if brotli_compress is not None:
+        compressors['br'] = brotli_compress
+    encodings = [encoding for encoding in encodings if encoding in compressors]
+
+    @server.after_request
+    def compress_response(response):
+        if not encodings or response.direct_passthrough or response.is_streamed:
+            return response
+        if 'Content-Encoding' in response.headers or response.status_code < 200 or response.status_code in (204, 304):
+            return response
+        accepted = request.accept_encodings
+        encoding = next((encoding for encoding in encodings if accepted[encoding]), None)
+        if encoding is None:
+            return response
+        response.vary.add('Accept-Encoding')
+        data = response.get_data()
+        if len(data) < min_bytes:
+            return response
+        response.set_data(compressors[encoding](data, level))
+        response.headers['Content-Encoding'] = encoding
+        compressed_responses.inc(encoding=encoding)
+        return response
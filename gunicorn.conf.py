@@ -0,0 +1,41 @@
+import logging
+import os
+
+# gunicorn reads this file when started from the repository directory, e.g.
+# gunicorn -w 4 dashboard:server
+
+# Workers share one campaign window, so every worker serves the same data
+# versions and a browser can be answered by any of them. Deployments on the
+# same host need different names; an empty name gives every worker its own
+# window.
+os.environ.setdefault('ADLIBS_SHARED_STORE', 'adlibs')
+
+# Every open dashboard holds a /api/events stream, so requests are served
+# by threads rather than one at a time per worker. A stream keeps its thread
+# for as long as the page is open; past ADLIBS_EVENT_STREAM_LIMIT streams a
+# worker tells further browsers to check back every 30 seconds instead, so
+# that the remaining threads are always free for callbacks. Raise both
+# numbers together for more open dashboards per worker.
+worker_class = 'gthread'
+threads = 128
+os.environ.setdefault('ADLIBS_EVENT_STREAM_LIMIT', str(threads - 32))
+
+
+def when_ready(server):
+    if server.cfg.workers > 1 and not os.environ['ADLIBS_SHARED_STORE']:
+        server.log.warning("ADLIBS_SHARED_STORE is empty: each of the %d workers generates its own data, "
+                           "so browsers see different data versions depending on the worker", server.cfg.workers)
+
+
+def post_worker_init(worker):
+    # Failures in the background threads (forecast refits, ingest appends,
+    # the version watch) are logged to "adlibs.*"; send them to gunicorn's
+    # error log.
+    logger = logging.getLogger('adlibs')
+    logger.handlers = worker.log.error_log.handlers
+    logger.setLevel(worker.log.error_log.level)
+    logger.propagate = False
+    # Workers only build the app on import; data production starts here.
+    import dashboard
+    dashboard.start_producer()
+    worker.log.info("Ad-Libs worker ready: %s", dashboard.startup_report())
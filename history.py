@@ -0,0 +1,207 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from ring_buffer import campaign_schema
+
+
+class CampaignHistory:
+    # Append-only columnar log on disk. Each segment is a directory with one
+    # raw little-endian file per column; reads memory-map those files, so a
+    # query only pages in the segments and columns it touches. A segment is
+    # sealed with a meta.json (row count and Timestamp range) once it holds
+    # `segment_rows` records, which lets time-range queries skip it.
+    #
+    # Only one process may write. Others open it with readonly=True: they
+    # see the segments the writer sealed and the rows every column of its
+    # active segment has, as of each read.
+    def __init__(self, directory, schema=campaign_schema, segment_rows=1_000_000, readonly=False):
+        self.directory = directory
+        self.schema = {name: np.dtype(dtype).newbyteorder('<') for name, dtype in schema.items()}
+        self.segment_rows = int(segment_rows)
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        self._segments = []
+        self._maps = {}
+        if readonly:
+            self._refresh()
+            return
+        os.makedirs(directory, exist_ok=True)
+        self._load_sealed()
+        self._open_active()
+
+    def _segment_path(self, index):
+        return os.path.join(self.directory, f"segment-{index:06d}")
+
+    def _load_sealed(self):
+        # Segments are sealed in order, so new ones follow the last known.
+        while True:
+            path = self._segment_path(len(self._segments))
+            meta_path = os.path.join(path, 'meta.json')
+            if not os.path.exists(meta_path):
+                return
+            with open(meta_path) as meta_file:
+                self._segments.append(dict(json.load(meta_file), path=path, sealed=True))
+
+    def _complete_rows(self, path):
+        return min(
+            os.path.getsize(os.path.join(path, name)) // dtype.itemsize
+            if os.path.exists(os.path.join(path, name)) else 0
+            for name, dtype in self.schema.items()
+        )
+
+    def _refresh(self):
+        # The writer may be halfway through a batch: only rows every column
+        # already has are read, and their range and order are not known.
+        with self._lock:
+            self._load_sealed()
+            path = self._segment_path(len(self._segments))
+            self._active = {'path': path, 'rows': self._complete_rows(path), 't_min': None, 't_max': None, 'sorted': False}
+
+    def _open_active(self):
+        path = self._segment_path(len(self._segments))
+        os.makedirs(path, exist_ok=True)
+        # After a crash the column files may differ in length; keep the rows
+        # every column has and drop the torn tail.
+        rows = self._complete_rows(path)
+        self._files = {}
+        for name, dtype in self.schema.items():
+            column_file = open(os.path.join(path, name), 'ab')
+            column_file.truncate(rows * dtype.itemsize)
+            self._files[name] = column_file
+        self._active = {'path': path, 'rows': rows, 't_min': None, 't_max': None, 'sorted': True}
+        if rows:
+            timestamps = self._map(self._active, 'Timestamp')
+            self._active.update(
+                t_min=float(timestamps.min()),
+                t_max=float(timestamps.max()),
+                sorted=bool(np.all(np.diff(timestamps) >= 0)),
+            )
+        # A crash between writing a segment's last rows and its meta.json
+        # leaves a full active segment; seal it now.
+        if rows >= self.segment_rows:
+            self._seal_active()
+
+    def _seal_active(self):
+        for column_file in self._files.values():
+            column_file.close()
+        meta = {key: value for key, value in self._active.items() if key != 'path'}
+        with open(os.path.join(self._active['path'], 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file)
+        self._segments.append(dict(self._active, sealed=True))
+        self._open_active()
+
+    def __len__(self):
+        return sum(segment['rows'] for segment in self._segments) + self._active['rows']
+
+    def append(self, batch):
+        if self.readonly:
+            raise ValueError("history opened read-only")
+        count = len(batch["Timestamp"])
+        # checked before any file is written: a short or 2-D column would
+        # leave the column files out of step with each other
+        for name in self.schema:
+            if np.ndim(batch[name]) != 1 or len(batch[name]) != count:
+                raise ValueError(f"column {name} must be 1-D with {count} rows")
+        if count == 0:
+            return
+        with self._lock:
+            offset = 0
+            while offset < count:
+                take = min(count - offset, self.segment_rows - self._active['rows'])
+                if take <= 0:
+                    self._seal_active()
+                    continue
+                for name, dtype in self.schema.items():
+                    self._files[name].write(np.ascontiguousarray(batch[name][offset:offset + take], dtype=dtype).tobytes())
+                for column_file in self._files.values():
+                    column_file.flush()
+                self._track(batch["Timestamp"][offset:offset + take])
+                self._active['rows'] += take
+                offset += take
+                if self._active['rows'] >= self.segment_rows:
+                    self._seal_active()
+
+    def _track(self, timestamps):
+        active = self._active
+        t_min, t_max = float(timestamps.min()), float(timestamps.max())
+        if np.any(np.diff(timestamps) < 0) or (active['t_max'] is not None and timestamps[0] < active['t_max']):
+            active['sorted'] = False
+        active['t_min'] = t_min if active['t_min'] is None else min(active['t_min'], t_min)
+        active['t_max'] = t_max if active['t_max'] is None else max(active['t_max'], t_max)
+
+    def _map(self, segment, name):
+        # Sealed segments never change, so their maps are reused; the active
+        # one is re-mapped at its current length.
+        key = (segment['path'], name)
+        if key in self._maps and len(self._maps[key]) == segment['rows']:
+            return self._maps[key]
+        if segment['rows'] == 0:
+            return np.empty(0, dtype=self.schema[name])
+        mapped = np.memmap(os.path.join(segment['path'], name), dtype=self.schema[name], mode='r', shape=(segment['rows'],))
+        if segment.get('sealed'):
+            self._maps[key] = mapped
+        return mapped
+
+    def scan(self, columns=None, start=None, end=None):
+        # Like read(), one part per segment, oldest first, without
+        # concatenating them.
+        columns = list(columns or self.schema)
+        if self.readonly:
+            self._refresh()
+        with self._lock:
+            segments = self._segments + ([dict(self._active)] if self._active['rows'] else [])
+        for segment in segments:
+            if start is not None and segment['t_max'] is not None and segment['t_max'] < start:
+                continue
+            if end is not None and segment['t_min'] is not None and segment['t_min'] >= end:
+                continue
+            timestamps = self._map(segment, 'Timestamp')
+            if segment['sorted']:
+                low = 0 if start is None else int(np.searchsorted(timestamps, start, 'left'))
+                high = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, 'left'))
+                selection = slice(low, high)
+            else:
+                mask = np.ones(len(timestamps), dtype=bool)
+                if start is not None:
+                    mask &= timestamps >= start
+                if end is not None:
+                    mask &= timestamps < end
+                selection = mask
+            yield {name: self._map(segment, name)[selection] for name in columns}
+
+    def read(self, columns=None, start=None, end=None):
+        # Columns of every record with start <= Timestamp < end. Data from a
+        # single sorted segment stays memory-mapped; spanning segments copies.
+        columns = list(columns or self.schema)
+        parts = list(self.scan(columns, start, end))
+        if not parts:
+            return {name: np.empty(0, dtype=self.schema[name]) for name in columns}
+        if len(parts) == 1:
+            return parts[0]
+        return {name: np.concatenate([part[name] for part in parts]) for name in columns}
+
+    def tail(self, count, columns=None):
+        # The newest `count` records, used to refill the in-memory window on
+        # startup.
+        columns = list(columns or self.schema)
+        if self.readonly:
+            self._refresh()
+        with self._lock:
+            segments = self._segments + [dict(self._active)]
+        parts = []
+        remaining = int(count)
+        for segment in reversed(segments):
+            if remaining <= 0:
+                break
+            rows = segment['rows']
+            take = min(rows, remaining)
+            if take:
+                parts.append({name: self._map(segment, name)[rows - take:] for name in columns})
+            remaining -= take
+        if not parts:
+            return {name: np.empty(0, dtype=self.schema[name]) for name in columns}
+        parts.reverse()
+        return {name: np.concatenate([part[name] for part in parts]) for name in columns}
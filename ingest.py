@@ -0,0 +1,298 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+import numpy as np
+from flask import jsonify, request
+
+from campaign_data import categories, derive_metrics
+from metrics import registry
+from ring_buffer import campaign_schema
+
+required_fields = ["AdType", "Region", "Device", "Period", "Impressions", "Clicks", "CPC", "Conversions", "Revenue", "BounceRate"]
+category_codes = {name: {label: code for code, label in enumerate(labels)} for name, labels in categories.items()}
+logger = logging.getLogger('adlibs.ingest')
+ingest_requests = registry.counter('adlibs_ingest_requests_total', "Requests to /api/ingest by outcome")
+ingested_events = registry.counter('adlibs_ingest_events_total', "Parsed events posted to /api/ingest by outcome")
+
+
+class IngestError(ValueError):
+    pass
+
+
+def numeric_column(field, values):
+    # One number per event: lists, strings (even numeric ones), booleans
+    # and nulls are rejected rather than converted.
+    if isinstance(values, np.ndarray):
+        valid = values.ndim == 1 and values.dtype.kind in 'iuf'
+    else:
+        valid = all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values)
+    if not valid:
+        raise IngestError(f"field '{field}' must be a number")
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError, OverflowError):
+        raise IngestError(f"field '{field}' must be a number")
+
+
+def category_column(field, values):
+    codes = category_codes[field]
+    for value in values:
+        if not isinstance(value, str) or value not in codes:
+            raise IngestError(f"unknown {field} {value!r}")
+    return np.array([codes[value] for value in values], dtype=np.int8)
+
+
+def campaign_id_column(values):
+    # CampaignID is kept as its 32-bit short id: the first 8 hex digits.
+    try:
+        ids = [int(str(value)[:8], 16) for value in values]
+    except ValueError:
+        raise IngestError("CampaignID must be hexadecimal")
+    if any(value < 0 for value in ids):
+        raise IngestError("CampaignID must be hexadecimal")
+    return np.array(ids, dtype=np.uint32)
+
+
+def parse_ndjson(body):
+    if body.lstrip().startswith('['):
+        try:
+            events = json.loads(body)
+        except ValueError:
+            raise IngestError("invalid JSON")
+        if not all(isinstance(event, dict) for event in events):
+            raise IngestError("expected an array of JSON objects")
+        return events_to_columns(events)
+    events = []
+    for number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError:
+            raise IngestError(f"line {number}: invalid JSON")
+        if not isinstance(event, dict):
+            raise IngestError(f"line {number}: expected a JSON object")
+        events.append(event)
+    return events_to_columns(events)
+
+
+def events_to_columns(events):
+    columns = {}
+    for field in required_fields:
+        try:
+            values = [event[field] for event in events]
+        except KeyError:
+            raise IngestError(f"missing field '{field}'")
+        if field in category_codes:
+            columns[field] = category_column(field, values)
+        else:
+            columns[field] = numeric_column(field, values)
+    if all("Timestamp" in event for event in events):
+        columns["Timestamp"] = numeric_column("Timestamp", [event["Timestamp"] for event in events])
+    if all("CampaignID" in event for event in events):
+        columns["CampaignID"] = campaign_id_column([event["CampaignID"] for event in events])
+    return validate_columns(columns)
+
+
+def parse_arrow(body):
+    try:
+        import pyarrow.ipc
+    except ImportError:
+        raise IngestError("Arrow payloads need pyarrow installed")
+    try:
+        table = pyarrow.ipc.open_stream(body).read_all()
+    except (pyarrow.ArrowException, OSError, ValueError):
+        raise IngestError("invalid Arrow stream")
+    columns = {}
+    for field in required_fields + ["Timestamp", "CampaignID"]:
+        if field not in table.column_names:
+            if field in required_fields:
+                raise IngestError(f"missing field '{field}'")
+            continue
+        column = table.column(field)
+        if field in category_codes:
+            columns[field] = category_column(field, column.to_pylist())
+        elif field == "CampaignID":
+            columns[field] = campaign_id_column(column.to_pylist())
+        else:
+            columns[field] = numeric_column(field, column.to_numpy())
+    return validate_columns(columns)
+
+
+def validate_columns(columns):
+    # Same invariants the generator guarantees; the derived metrics are
+    # always recomputed server-side rather than trusted from the client.
+    count = len(columns["Clicks"])
+    if any(np.ndim(values) != 1 or len(values) != count for values in columns.values()):
+        raise IngestError("every field must hold one value per event")
+    for field in ("Impressions", "Clicks", "Conversions", "CPC", "Revenue", "BounceRate"):
+        values = columns[field]
+        if not np.all(np.isfinite(values)) or np.any(values < 0):
+            raise IngestError(f"field '{field}' must be finite and non-negative")
+    for field in ("Impressions", "Clicks", "Conversions"):
+        if np.any(columns[field] != np.floor(columns[field])):
+            raise IngestError(f"field '{field}' must be an integer")
+        # stored as int32
+        if np.any(columns[field] > np.iinfo(np.int32).max):
+            raise IngestError(f"field '{field}' must be at most {np.iinfo(np.int32).max}")
+    if "Timestamp" in columns and not np.all(np.isfinite(columns["Timestamp"])):
+        raise IngestError("field 'Timestamp' must be finite")
+    if np.any(columns["Clicks"] > columns["Impressions"]):
+        raise IngestError("Clicks cannot exceed Impressions")
+    if np.any(columns["Conversions"] > columns["Clicks"]):
+        raise IngestError("Conversions cannot exceed Clicks")
+    if np.any(columns["BounceRate"] > 100):
+        raise IngestError("BounceRate is a percentage")
+
+    for field in ("Impressions", "Clicks", "Conversions"):
+        columns[field] = columns[field].astype(np.int32)
+    if "Timestamp" not in columns:
+        columns["Timestamp"] = np.full(count, time.time())
+    if "CampaignID" not in columns:
+        columns["CampaignID"] = np.frombuffer(os.urandom(4 * count), dtype=np.uint32).copy()
+    derive_metrics(columns)
+    return {name: np.ascontiguousarray(columns[name], dtype=dtype) for name, dtype in campaign_schema.items()}
+
+
+def concat_batches(batches):
+    if len(batches) == 1:
+        return batches[0]
+    return {name: np.concatenate([batch[name] for batch in batches]) for name in batches[0]}
+
+
+def append_batches(sink, batches):
+    # One bulk append of everything drained; should the batches not combine,
+    # they are appended one by one, so a bad batch cannot take the others
+    # (all already answered 202) down with it.
+    try:
+        batches = [concat_batches(batches)]
+    except Exception:
+        logger.exception("Could not combine %d ingest batches, appending them one by one", len(batches))
+    for batch in batches:
+        try:
+            sink(batch)
+        except Exception:
+            logger.exception("Ingest append failed")
+
+
+class IngestQueue:
+    # Bounded hand-off between request threads and the single writer:
+    # put() never blocks and reports False when full, and the consumer
+    # drains everything waiting into one bulk append.
+    def __init__(self, sink, max_batches=256):
+        self._sink = sink
+        self._queue = queue.Queue(maxsize=max_batches)
+        self._thread = None
+
+    def put(self, batch):
+        try:
+            self._queue.put_nowait(batch)
+            return True
+        except queue.Full:
+            return False
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._consume, daemon=True)
+        self._thread.start()
+
+    def _consume(self):
+        while True:
+            batches = [self._queue.get()]
+            while True:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            append_batches(self._sink, batches)
+
+
+class SpoolIngestQueue:
+    # Used with the shared store, where only the producer process may write:
+    # any worker spools validated batches as .npz files and the producer's
+    # consumer picks them up. The number of spooled files bounds the queue.
+    def __init__(self, sink, directory, max_batches=256, poll_interval=0.05):
+        self._sink = sink
+        self.directory = directory
+        self.max_batches = max_batches
+        self.poll_interval = poll_interval
+        os.makedirs(directory, exist_ok=True)
+
+    def _spooled(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith('.npz'))
+
+    def pending(self):
+        return len(self._spooled())
+
+    def put(self, batch):
+        if self.pending() >= self.max_batches:
+            return False
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex}"
+        temporary = os.path.join(self.directory, name + '.tmp')
+        with open(temporary, 'wb') as spool_file:
+            np.savez(spool_file, **batch)
+        os.replace(temporary, os.path.join(self.directory, name + '.npz'))
+        return True
+
+    def start(self):
+        self._thread = threading.Thread(target=self._consume, daemon=True)
+        self._thread.start()
+
+    def _consume(self):
+        while True:
+            names = self._spooled()
+            if not names:
+                time.sleep(self.poll_interval)
+                continue
+            batches = []
+            for name in names:
+                path = os.path.join(self.directory, name)
+                try:
+                    with np.load(path) as spooled:
+                        batches.append({key: spooled[key] for key in spooled.files})
+                except Exception:
+                    logger.exception("Dropping unreadable spool file %s", name)
+                os.remove(path)
+            if batches:
+                append_batches(self._sink, batches)
+
+
+def register_ingest_route(server, ingest_queue, max_records=100000):
+    @server.route('/api/ingest', methods=['POST'])
+    def ingest_events():
+        content_type = request.mimetype
+        try:
+            if content_type == 'application/vnd.apache.arrow.stream':
+                batch = parse_arrow(request.get_data())
+            elif content_type in ('application/x-ndjson', 'application/json', 'text/plain'):
+                batch = parse_ndjson(request.get_data(as_text=True))
+            else:
+                ingest_requests.inc(result='unsupported')
+                return jsonify(error=f"unsupported content type '{content_type}'"), 415
+        except IngestError as error:
+            ingest_requests.inc(result='invalid')
+            return jsonify(error=str(error)), 400
+
+        count = len(batch["Clicks"])
+        if count == 0:
+            return jsonify(accepted=0), 202
+        if count > max_records:
+            ingest_requests.inc(result='too_large')
+            ingested_events.inc(count, result='too_large')
+            return jsonify(error=f"at most {max_records} events per request"), 413
+        if not ingest_queue.put(batch):
+            ingest_requests.inc(result='throttled')
+            ingested_events.inc(count, result='throttled')
+            response = jsonify(error="ingest queue is full, retry later")
+            response.headers['Retry-After'] = '1'
+            return response, 429
+        ingest_requests.inc(result='accepted')
+        ingested_events.inc(count, result='accepted')
+        return jsonify(accepted=count), 202
@@ -0,0 +1,227 @@
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from campaign_data import categories, generate_campaign_columns
+from history import CampaignHistory
+from ingest import required_fields
+
+# Reproducible load for capacity tests. The same seed, rate and bursts give
+# the same stream of records every time; producers pace it in real time and
+# post it to /api/ingest, or record it (in the CampaignHistory format) to
+# replay later at any speed.
+#
+#   python loadgen.py generate --seed 1 --rate 2000 --bursts 60:10:5 --target http://127.0.0.1:8050
+#   python loadgen.py generate --seed 1 --rate 2000 --duration 600 --record stream
+#   python loadgen.py replay stream --speed 10 --target http://127.0.0.1:8050
+
+
+def parse_bursts(text):
+    # "PERIOD:LENGTH:FACTOR[,...]": for LENGTH seconds out of every PERIOD,
+    # the rate is multiplied by FACTOR.
+    bursts = []
+    for part in filter(None, (text or '').split(',')):
+        period, length, factor = (float(value) for value in part.split(':'))
+        if period <= 0 or length < 0 or factor < 0:
+            raise ValueError(f"invalid burst '{part}'")
+        bursts.append((period, length, factor))
+    return bursts
+
+
+class LoadProfile:
+    def __init__(self, rate, bursts=()):
+        self.rate = float(rate)
+        self.bursts = list(bursts)
+
+    def rate_at(self, elapsed):
+        rate = self.rate
+        for period, length, factor in self.bursts:
+            if elapsed % period < length:
+                rate *= factor
+        return rate
+
+
+def schedule(profile, tick, duration=None):
+    # (offset in seconds, number of events) for every tick. Fractions of an
+    # event carry over to the next tick, so the average matches the rate.
+    carry = 0.0
+    index = 0
+    while duration is None or index * tick < duration:
+        offset = index * tick
+        carry += profile.rate_at(offset) * tick
+        # tolerate rounding, e.g. 5/60 events a second over 60 seconds
+        count = int(carry + 1e-9)
+        carry -= count
+        yield offset, count
+        index += 1
+
+
+def generate_stream(profile, seed, tick=0.1, duration=None, start=None):
+    # (offset, batch) pairs, every batch timestamped `start + offset`.
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    start = time.time() if start is None else start
+    for offset, count in schedule(profile, tick, duration):
+        if count:
+            yield offset, generate_campaign_columns(count, seed=rng, timestamp=start + offset)
+
+
+def replay_stream(directory, speed=1.0, tick=0.1, start=None):
+    # A recorded stream as (offset, batch) pairs of `tick` recorded seconds,
+    # retimed so that it plays from `start` at `speed` times the original
+    # pace. Offsets are in recorded seconds.
+    columns = CampaignHistory(directory).read()
+    timestamps = columns['Timestamp']
+    if len(timestamps) == 0:
+        return
+    order = np.argsort(timestamps, kind='stable')
+    columns = {name: values[order] for name, values in columns.items()}
+    offsets = columns['Timestamp'] - columns['Timestamp'][0]
+    start = time.time() if start is None else start
+    ticks = np.floor(offsets / tick + 1e-9).astype(np.int64)
+    bounds = np.flatnonzero(np.diff(ticks)) + 1
+    for low, high in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(ticks)]])):
+        batch = {name: values[low:high].copy() for name, values in columns.items()}
+        batch['Timestamp'] = start + offsets[low:high] / speed
+        yield float(offsets[low]), batch
+
+
+def paced(stream, speed=1.0):
+    # Releases each (offset, value) of `stream` at `offset / speed` seconds
+    # after the first, yielding (lag, value) where lag is how many seconds
+    # late the value came out. A late producer catches up without sleeping.
+    started = time.perf_counter()
+    for offset, value in stream:
+        due = started + offset / speed
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        yield max(0.0, time.perf_counter() - due), value
+
+
+def batch_to_ndjson(batch):
+    labels = {field: np.asarray(categories[field], dtype=object) for field in categories}
+    fields = {}
+    for field in required_fields:
+        values = batch[field]
+        fields[field] = labels[field][values.astype(np.intp)] if field in labels else values.tolist()
+    fields['Timestamp'] = batch['Timestamp'].tolist()
+    fields['CampaignID'] = [f"{value:08x}" for value in batch['CampaignID'].tolist()]
+    names = list(fields)
+    return '\n'.join(json.dumps(dict(zip(names, row))) for row in zip(*(fields[name] for name in names)))
+
+
+class IngestClient:
+    # Posts batches to /api/ingest, waiting out 429 answers as asked by
+    # Retry-After so throttling shows up as lag rather than lost events.
+    def __init__(self, target, timeout=30):
+        import requests
+        self.url = target.rstrip('/') + '/api/ingest'
+        self.session = requests.Session()
+        self.timeout = timeout
+        self.throttled = 0
+
+    def __call__(self, batch):
+        body = batch_to_ndjson(batch)
+        while True:
+            response = self.session.post(self.url, data=body, headers={'Content-Type': 'application/x-ndjson'}, timeout=self.timeout)
+            if response.status_code != 429:
+                break
+            self.throttled += 1
+            time.sleep(float(response.headers.get('Retry-After', 1)))
+        if response.status_code != 202:
+            raise RuntimeError(f"{self.url} answered {response.status_code}: {response.text[:200]}")
+
+
+def produce(stream, sink, speed=1.0, realtime=True):
+    # Feeds a stream to `sink` and returns what happened.
+    events = batches = 0
+    max_lag = 0.0
+    started = time.perf_counter()
+    items = paced(stream, speed) if realtime else ((0.0, batch) for _, batch in stream)
+    for lag, batch in items:
+        sink(batch)
+        events += len(batch['Clicks'])
+        batches += 1
+        max_lag = max(max_lag, lag)
+    return {
+        'events': events,
+        'batches': batches,
+        'seconds': time.perf_counter() - started,
+        'max_lag_seconds': max_lag,
+        'throttled': getattr(sink, 'throttled', 0),
+    }
+
+
+def generate_worker(index, processes, args):
+    # One of `processes` producers: a share of the rate and its own
+    # independent, reproducible random stream. A single producer uses the
+    # seed as is, so it posts exactly what --record writes.
+    seed = args.seed if processes == 1 else np.random.SeedSequence(args.seed).spawn(processes)[index]
+    rng = np.random.default_rng(seed)
+    profile = LoadProfile(args.rate / processes, args.bursts)
+    stream = generate_stream(profile, rng, tick=args.tick, duration=args.duration)
+    return produce(stream, IngestClient(args.target))
+
+
+def print_stats(stats):
+    rate = stats['events'] / stats['seconds'] if stats['seconds'] else 0.0
+    print(f"{stats['events']} events in {stats['batches']} batches over {stats['seconds']:.1f}s "
+          f"({rate:,.0f} events/s), max lag {stats['max_lag_seconds']:.3f}s, throttled {stats['throttled']}x")
+
+
+def merge_stats(results):
+    return {
+        'events': sum(result['events'] for result in results),
+        'batches': sum(result['batches'] for result in results),
+        'seconds': max(result['seconds'] for result in results),
+        'max_lag_seconds': max(result['max_lag_seconds'] for result in results),
+        'throttled': sum(result['throttled'] for result in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate or replay reproducible Ad-Libs load")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help="generate campaign events at a target rate")
+    generate.add_argument('--seed', type=int, default=0, help="random seed; the same seed gives the same stream")
+    generate.add_argument('--rate', type=float, default=100, help="events per second")
+    generate.add_argument('--bursts', type=parse_bursts, default=[],
+                          help="PERIOD:LENGTH:FACTOR[,...], e.g. 60:10:5 for 5x the rate 10s out of every minute")
+    generate.add_argument('--duration', type=float, default=60, help="seconds of load")
+    generate.add_argument('--tick', type=float, default=0.1, help="seconds between batches")
+    generate.add_argument('--processes', type=int, default=1, help="producer processes posting in parallel")
+    output = generate.add_mutually_exclusive_group(required=True)
+    output.add_argument('--target', help="dashboard URL to post to, e.g. http://127.0.0.1:8050")
+    output.add_argument('--record', metavar='DIRECTORY', help="write the stream to a directory instead, as fast as possible")
+
+    replay = commands.add_parser('replay', help="replay a recorded stream")
+    replay.add_argument('directory', help="directory written by generate --record")
+    replay.add_argument('--speed', type=float, default=1.0, help="playback speed, e.g. 10 for ten times faster")
+    replay.add_argument('--tick', type=float, default=0.1, help="recorded seconds per posted batch")
+    replay.add_argument('--target', required=True, help="dashboard URL to post to")
+
+    args = parser.parse_args()
+    if args.command == 'replay':
+        stats = produce(replay_stream(args.directory, args.speed, args.tick), IngestClient(args.target), speed=args.speed)
+    elif args.record:
+        if args.processes != 1:
+            parser.error("--record writes a single stream; leave out --processes")
+        history = CampaignHistory(args.record)
+        stream = generate_stream(LoadProfile(args.rate, args.bursts), args.seed, tick=args.tick, duration=args.duration)
+        stats = produce(stream, history.append, realtime=False)
+    elif args.processes > 1:
+        with multiprocessing.get_context('spawn').Pool(args.processes) as pool:
+            stats = merge_stats(pool.starmap(generate_worker, [(index, args.processes, args) for index in range(args.processes)]))
+    else:
+        stats = generate_worker(0, 1, args)
+    print_stats(stats)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
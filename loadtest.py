@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmark import callback_body, panels
+from campaign_data import categories
+
+# Load test for the Dash callback endpoint: N simulated browser sessions
+# refresh every panel the way the page does, with their own theme, filters,
+# forecast segment and report downloads, while the server's CPU and memory
+# are sampled. Run it next to `loadgen.py generate` to have data arriving
+# during the test.
+#
+#   python loadtest.py --serve 4 --sessions 50 --duration 60
+#   python loadtest.py --target http://127.0.0.1:8050 --pid 1234 --sessions 20
+
+filter_ids = {
+    'AdType': 'filter-adtype',
+    'Region': 'filter-region',
+    'Device': 'filter-device',
+    'Period': 'filter-period',
+}
+forecast_segments = ['all'] + [f"{dimension}={label}" for dimension in ('AdType', 'Region') for label in categories[dimension]]
+
+
+def process_tree(pid):
+    # pid and all of its descendants, e.g. a gunicorn master and its workers
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as stat:
+                    parents.setdefault(int(stat.read().rsplit(')', 1)[1].split()[1]), []).append(int(entry))
+            except OSError:
+                continue
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(parents.get(current, []))
+    return tree
+
+
+def process_usage(pid):
+    # (CPU seconds, resident bytes) of one process from /proc
+    with open(f'/proc/{pid}/stat') as stat:
+        fields = stat.read().rsplit(')', 1)[1].split()
+    with open(f'/proc/{pid}/statm') as statm:
+        resident_pages = int(statm.read().split()[1])
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return cpu, resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+class ResourceSampler:
+    # Samples the CPU time and memory of the server processes in the
+    # background; workers started or restarted during the run are picked up.
+    def __init__(self, pids, interval=0.5):
+        self.pids = list(pids)
+        self.interval = interval
+        self.cpu_start = {}
+        self.cpu_end = {}
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        rss = 0
+        for root in self.pids:
+            for pid in process_tree(root):
+                try:
+                    cpu, resident = process_usage(pid)
+                except (OSError, ValueError, IndexError):
+                    continue
+                self.cpu_start.setdefault(pid, cpu)
+                self.cpu_end[pid] = cpu
+                rss += resident
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._sample()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        seconds = time.perf_counter() - self.started
+        cpu = sum(self.cpu_end[pid] - self.cpu_start[pid] for pid in self.cpu_end)
+        return {'cpu_seconds': cpu, 'cpu_cores': cpu / seconds if seconds else 0.0, 'peak_rss_bytes': self.peak_rss}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, ok=True):
+        with self._lock:
+            if ok:
+                self.latencies.setdefault(name, []).append(seconds)
+            else:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+
+class BrowserSession:
+    # One simulated browser tab. It keeps the version stores the page keeps,
+    # so the server sees the same mix of full renders, patches and unchanged
+    # answers a real client causes.
+    def __init__(self, target, dependencies, recorder, rng, args):
+        import requests
+        self.url = target.rstrip('/') + '/_dash-update-component'
+        self.http = requests.Session()
+        self.recorder = recorder
+        self.rng = rng
+        self.args = args
+        self.panels = {
+            name: next(item for item in dependencies if item['output'].strip('.').startswith(output_id + '.'))
+            for name, output_id in panels.items()
+        }
+        self.report = next(item for item in dependencies if item['output'].strip('.').startswith('download-report.data...'))
+        self.report_poll = next(item for item in dependencies if item['inputs'][0]['id'] == 'report-poll')
+        self.theme = 'dark' if rng.random() < args.dark_ratio else 'light'
+        self.inputs = {'data-version': 0, 'forecast-segment': 'all', 'download-report-btn': 0, 'report-poll': 0}
+        self.stores = {}
+        self.choose_filters()
+
+    def choose_filters(self):
+        for component_id in filter_ids.values():
+            self.inputs[component_id] = []
+        if self.rng.random() < self.args.filter_ratio:
+            for dimension in self.rng.choice(list(filter_ids), size=self.rng.integers(1, 3), replace=False):
+                labels = self.rng.choice(categories[dimension], size=self.rng.integers(1, 3), replace=False)
+                self.inputs[filter_ids[dimension]] = [str(label) for label in labels]
+
+    def post(self, name, dependency):
+        state = dict(self.stores, theme=self.theme)
+        body = callback_body(dependency, self.inputs, state)
+        started = time.perf_counter()
+        try:
+            response = self.http.post(self.url, json=body, timeout=self.args.timeout)
+        except Exception:
+            self.recorder.add(name, time.perf_counter() - started, ok=False)
+            return {}
+        elapsed = time.perf_counter() - started
+        if response.status_code == 204:
+            self.recorder.add(name, elapsed)
+            return {}
+        if response.status_code != 200:
+            self.recorder.add(name, elapsed, ok=False)
+            return {}
+        self.recorder.add(name, elapsed)
+        outputs = response.json().get('response', {})
+        for component_id, values in outputs.items():
+            if component_id.endswith('-version'):
+                self.stores[component_id] = values.get('data')
+        return outputs
+
+    def refresh(self):
+        # What a pushed data version (or changed input) sets off in the page
+        self.inputs['data-version'] += 1
+        for name, dependency in self.panels.items():
+            self.post(name, dependency)
+
+    def download_report(self, deadline):
+        started = time.perf_counter()
+        self.inputs['download-report-btn'] += 1
+        outputs = self.post('report.request', self.report)
+        while 'data' not in outputs.get('download-report', {}) and self.stores.get('report-version') is not None:
+            if time.perf_counter() > deadline:
+                return
+            time.sleep(1)
+            self.inputs['report-poll'] += 1
+            outputs = self.post('report.poll', self.report_poll)
+        self.recorder.add('report.download', time.perf_counter() - started)
+
+    def run(self, deadline):
+        # Sessions open at random moments within the first interval.
+        time.sleep(self.rng.uniform(0, self.args.interval))
+        while time.perf_counter() < deadline:
+            if self.rng.random() < self.args.change_ratio:
+                self.choose_filters()
+                self.inputs['forecast-segment'] = str(self.rng.choice(forecast_segments))
+            if self.rng.random() < self.args.theme_switch_ratio:
+                self.theme = 'dark' if self.theme == 'light' else 'light'
+            self.refresh()
+            if self.rng.random() < self.args.download_ratio:
+                self.download_report(deadline)
+            time.sleep(min(self.rng.exponential(self.args.interval), max(0.0, deadline - time.perf_counter())))
+
+
+def serve(workers, port, shared_store):
+    # `shared_store` names the store the workers share, or is empty to give
+    # every worker its own data.
+    directory = os.path.dirname(os.path.abspath(__file__))
+    command = ['gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}', 'dashboard:server']
+    env = dict(os.environ, ADLIBS_SHARED_STORE=shared_store)
+    return subprocess.Popen(command, cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def remove_store(name):
+    from multiprocessing import shared_memory
+    try:
+        shared_memory.SharedMemory(name=name).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def wait_until_ready(target, timeout=60):
+    import requests
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(target.rstrip('/') + '/_dash-dependencies', timeout=5).status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{target} did not come up within {timeout}s")
+
+
+def run(args):
+    import requests
+    wait_until_ready(args.target)
+    dependencies = requests.get(args.target.rstrip('/') + '/_dash-dependencies', timeout=30).json()
+    recorder = Recorder()
+    seeds = np.random.SeedSequence(args.seed).spawn(args.sessions)
+    sessions = [BrowserSession(args.target, dependencies, recorder, np.random.default_rng(seed), args) for seed in seeds]
+    sampler = ResourceSampler(args.pid) if args.pid else None
+    if sampler:
+        sampler.start()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=session.run, args=(deadline,), daemon=True) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.perf_counter()) + args.timeout)
+    seconds = time.perf_counter() - started
+
+    results = {'sessions': args.sessions, 'seconds': seconds, 'store': args.store, 'callbacks': {}}
+    requests_done = 0
+    for name in sorted(set(recorder.latencies) | set(recorder.errors)):
+        latencies = np.asarray(recorder.latencies.get(name, []))
+        stats = {'count': len(latencies), 'errors': recorder.errors.get(name, 0)}
+        if len(latencies):
+            stats.update(zip(('p50', 'p95', 'p99'), np.percentile(latencies, [50, 95, 99]).tolist()))
+        if not name.startswith('report.download'):
+            requests_done += stats['count'] + stats['errors']
+        results['callbacks'][name] = stats
+    results['requests_per_second'] = requests_done / seconds
+    if sampler:
+        results['server'] = sampler.stop()
+    return results
+
+
+def print_results(results):
+    print(f"{results['sessions']} sessions for {results['seconds']:.1f}s against a {results['store']} store: "
+          f"{results['requests_per_second']:.1f} callback requests/s")
+    for name, stats in results['callbacks'].items():
+        line = f"{name:18} {stats['count']:7d} ok {stats['errors']:5d} failed"
+        if 'p50' in stats:
+            line += f"  p50 {stats['p50'] * 1000:8.1f} ms  p95 {stats['p95'] * 1000:8.1f} ms  p99 {stats['p99'] * 1000:8.1f} ms"
+        print(line)
+    if 'server' in results:
+        server = results['server']
+        print(f"server: {server['cpu_cores']:.2f} CPU cores busy on average, peak RSS {server['peak_rss_bytes'] / 2 ** 20:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Ad-Libs dashboard callbacks with concurrent sessions")
+    parser.add_argument('--target', default='http://127.0.0.1:8050', help="dashboard URL")
+    parser.add_argument('--serve', type=int, metavar='WORKERS', help="start gunicorn with this many workers on the target's port")
+    parser.add_argument('--per-worker-store', action='store_true',
+                        help="with --serve, give every worker its own data instead of one shared store")
+    parser.add_argument('--pid', type=int, action='append', default=[], help="server process to sample (with its children)")
+    parser.add_argument('--sessions', type=int, default=10, help="concurrent browser sessions")
+    parser.add_argument('--duration', type=float, default=60, help="seconds to run")
+    parser.add_argument('--interval', type=float, default=5, help="mean seconds between a session's refreshes")
+    parser.add_argument('--dark-ratio', type=float, default=0.5, help="share of sessions using the dark theme")
+    parser.add_argument('--filter-ratio', type=float, default=0.3, help="share of filter choices that select something")
+    parser.add_argument('--change-ratio', type=float, default=0.1, help="chance a refresh comes with new filters and forecast segment")
+    parser.add_argument('--theme-switch-ratio', type=float, default=0.02, help="chance a refresh comes after a theme switch")
+    parser.add_argument('--download-ratio', type=float, default=0.01, help="chance a refresh is followed by a report download")
+    parser.add_argument('--timeout', type=float, default=60, help="seconds before a request counts as failed")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the sessions' choices")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    server = None
+    # What the workers read. Served workers share a store of their own, so
+    # the test neither touches a deployment's data nor measures unrelated
+    # per-worker datasets; a server started elsewhere runs as deployed.
+    args.store = 'external'
+    if args.serve:
+        port = args.target.rstrip('/').rsplit(':', 1)[1]
+        store_name = '' if args.per_worker_store else f'adlibs_loadtest_{port}'
+        server = serve(args.serve, port, store_name)
+        args.pid.append(server.pid)
+        args.store = 'shared' if store_name else 'per-worker'
+    try:
+        results = run(args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            if store_name:
+                remove_store(store_name)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(dict(results, created=datetime.now().isoformat(timespec='seconds'), options=vars(args)), output, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+# Minimal Prometheus text-format metrics: counters, histograms and gauges
+# read from a function at scrape time. Metrics live in the process that
+# records them, so with several gunicorn workers each worker is scraped on
+# its own; gauges computed from the shared campaign window agree across them.
+
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+logger = logging.getLogger('adlibs.metrics')
+byte_buckets = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name, labels, value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=default_buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, list(counts), total) for labels, (counts, total) in self._values.items())
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', labels + (('le', format_value(bound)),), cumulative
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help, function):
+        # function() returns a number, or a list of (labels dict, number)
+        self.name = name
+        self.help = help
+        self._function = function
+
+    def samples(self):
+        values = self._function()
+        if not isinstance(values, list):
+            values = [({}, values)]
+        for labels, value in values:
+            yield self.name, tuple(sorted(labels.items())), value
+
+
+class CounterGauge(Gauge):
+    # A counter whose value is read at scrape time, e.g. a total kept in the
+    # shared campaign window.
+    kind = 'counter'
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        # Registering a name again returns the existing metric, so modules
+        # and app factories can declare their metrics more than once.
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help))
+
+    def histogram(self, name, help, buckets=default_buckets):
+        return self.register(Histogram(name, help, buckets))
+
+    def gauge(self, name, help, function, kind=Gauge):
+        return self.register(kind(name, help, function))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                logger.exception("Metric %s failed", metric.name)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+stage_seconds = registry.histogram('adlibs_stage_seconds', "Time spent in each stage of the dashboard, report and producer hot paths")
+
+
+def timed(stage):
+    return stage_seconds.time(stage=stage)
+
+
+def observe_stage(stage, started):
+    # For stages too long to wrap in timed(): `started` is a perf_counter()
+    # reading taken when the stage began.
+    stage_seconds.observe(time.perf_counter() - started, stage=stage)
+
+
+def register_metrics_route(server, metrics_registry=registry):
+    callback_seconds = metrics_registry.histogram('adlibs_callback_seconds', "Dash callback requests by first output, including JSON serialization")
+    callback_bytes = metrics_registry.histogram('adlibs_callback_response_bytes', "Dash callback response sizes by first output", buckets=byte_buckets)
+
+    @server.before_request
+    def start_callback_timer():
+        if request.path.endswith('/_dash-update-component'):
+            g.callback_started = time.perf_counter()
+
+    @server.after_request
+    def observe_callback(response):
+        started = g.pop('callback_started', None)
+        if started is not None:
+            body = request.get_json(silent=True) or {}
+            output = body.get('output', '').strip('.').split('.')[0]
+            callback_seconds.observe(time.perf_counter() - started, output=output)
+            callback_bytes.observe(response.content_length or 0, output=output)
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
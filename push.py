@@ -0,0 +1,105 @@
+import json
+import logging
+import threading
+import time
+
+from flask import Response
+
+from metrics import registry
+
+logger = logging.getLogger('adlibs.push')
+
+
+class VersionNotifier:
+    # Watches the data version and wakes every open event stream when it
+    # changes. A single thread polls `source()`, however many clients are
+    # connected; under the shared store that is a read of the window state
+    # the producer process writes.
+    def __init__(self, source, interval=0.5):
+        self._source = source
+        self.interval = interval
+        self.current = None
+        self.clients = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._condition:
+            if self._thread is None:
+                self.current = self._source()
+                self._thread = threading.Thread(target=self._watch, daemon=True)
+                self._thread.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                value = self._source()
+            except Exception:
+                logger.exception("Version watch failed")
+                continue
+            with self._condition:
+                if value != self.current:
+                    self.current = value
+                    self._condition.notify_all()
+
+    def connect(self, limit=0):
+        # Counts a new stream in, unless `limit` (0 for none) are open.
+        with self._condition:
+            if limit and self.clients >= limit:
+                return False
+            self.clients += 1
+            return True
+
+    def disconnect(self):
+        with self._condition:
+            self.clients -= 1
+
+    def wait(self, last, timeout):
+        # The current version once it differs from `last`, or None when
+        # `timeout` seconds pass without a change.
+        with self._condition:
+            self._condition.wait_for(lambda: self.current != last, timeout)
+            return self.current if self.current != last else None
+
+
+stream_overflows = registry.counter('adlibs_event_stream_overflows_total', "Event streams over the limit, sent the current version and closed")
+
+
+def event_stream(notifier, keepalive=15, retry=3000, limit=0, busy_retry=30000):
+    # Server-sent events: the current version right away, then one event
+    # per new version. Comments keep idle connections open through proxies
+    # and reveal disconnected clients. Every open stream holds a server
+    # thread, so past `limit` streams a client gets the current version and
+    # the stream ends; the browser reconnects after `busy_retry` ms, i.e.
+    # it polls slowly instead of taking a thread from the callbacks.
+    notifier.start()
+    if not notifier.connect(limit):
+        stream_overflows.inc()
+        yield f"retry: {busy_retry}\n\n"
+        yield f"event: version\ndata: {json.dumps(notifier.current)}\n\n"
+        return
+    try:
+        yield f"retry: {retry}\n\n"
+        last = None
+        while True:
+            version = notifier.wait(last, keepalive)
+            if version is None:
+                yield ": keepalive\n\n"
+                continue
+            last = version
+            yield f"event: version\ndata: {json.dumps(version)}\n\n"
+    finally:
+        notifier.disconnect()
+
+
+def register_events_route(server, notifier, keepalive=15, limit=0):
+    registry.gauge('adlibs_event_stream_clients', "Browsers connected to /api/events", lambda: notifier.clients)
+
+    @server.route('/api/events')
+    def events():
+        response = Response(event_stream(notifier, keepalive, limit=limit), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        # stops nginx from buffering the stream
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
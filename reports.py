@@ -0,0 +1,294 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from campaign_data import categories
+from metrics import timed
+from rollups import lttb
+
+chart_colors = ["#145A32", "#1E8449", "#229954", "#27AE60", "#52BE80", "#7DCEA0", "#A9DFBF"]
+# Most points drawn for the revenue line, whatever the window size
+REPORT_LINE_POINTS = 500
+
+
+def render_chart(chart, width=400, height=300):
+    # Draws a chart as reportlab vector graphics, which the PDF stores as a
+    # few drawing operators instead of an image.
+    from reportlab.graphics.charts.barcharts import VerticalBarChart
+    from reportlab.graphics.charts.lineplots import LinePlot
+    from reportlab.graphics.shapes import Drawing, Group, String
+    from reportlab.lib import colors
+
+    text_color = colors.HexColor("#2E4053")
+    if chart['kind'] == 'bar':
+        plot = VerticalBarChart()
+        plot.data = [chart['values']]
+        plot.categoryAxis.categoryNames = chart['labels']
+        if len(chart['labels']) > 5:
+            plot.categoryAxis.labels.angle = 30
+            plot.categoryAxis.labels.boxAnchor = 'ne'
+        plot.bars.strokeColor = None
+        for index in range(len(chart['values'])):
+            plot.bars[(0, index)].fillColor = colors.HexColor(chart_colors[index % len(chart_colors)])
+        plot.valueAxis.valueMin = 0
+        axes = [plot.categoryAxis, plot.valueAxis]
+    else:
+        plot = LinePlot()
+        plot.data = [list(zip(chart['x'], chart['values']))]
+        plot.lines[0].strokeColor = colors.HexColor(chart_colors[1])
+        plot.lines[0].strokeWidth = 1
+        axes = [plot.xValueAxis, plot.yValueAxis]
+    for axis in axes:
+        axis.labels.fontName = 'Helvetica'
+        axis.labels.fontSize = 7
+    plot.x, plot.y = 60, 60
+    plot.width, plot.height = width - 80, height - 100
+
+    drawing = Drawing(width, height)
+    drawing.add(plot)
+    drawing.add(String(width / 2, height - 18, chart['title'], fontName='Helvetica', fontSize=14, fillColor=text_color, textAnchor='middle'))
+    drawing.add(String(plot.x + plot.width / 2, 4, chart['xlabel'], fontName='Helvetica', fontSize=10, fillColor=text_color, textAnchor='middle'))
+    ylabel = Group(String(0, 0, chart['ylabel'], fontName='Helvetica', fontSize=10, fillColor=text_color, textAnchor='middle'))
+    ylabel.translate(14, plot.y + plot.height / 2)
+    ylabel.rotate(90)
+    drawing.add(ylabel)
+    return drawing
+
+
+def group_means(codes, values, labels):
+    # Mean of `values` per category code, for the categories present.
+    counts = np.bincount(codes, minlength=len(labels))
+    sums = np.bincount(codes, weights=values, minlength=len(labels))
+    present = np.flatnonzero(counts)
+    return [labels[code] for code in present], (sums[present] / counts[present]).tolist()
+
+
+def report_charts(columns):
+    charts = []
+    for x, y, title in [
+        ('AdType', 'ROAS', 'Average ROAS by Ad Type'),
+        ('Device', 'CTR', 'Average CTR by Device'),
+        ('Region', 'Clicks', 'Clicks by Region'),
+    ]:
+        labels, values = group_means(columns[x].astype(np.intp), columns[y], categories[x])
+        charts.append({
+            'kind': 'bar',
+            'labels': labels,
+            'values': values,
+            'title': title,
+            'xlabel': x,
+            'ylabel': y
+        })
+    revenue = np.asarray(columns['Revenue'], dtype=np.float64)
+    x = np.arange(len(revenue), dtype=np.float64)
+    kept = lttb(x, revenue, REPORT_LINE_POINTS)
+    charts.append({
+        'kind': 'line',
+        'x': x[kept].tolist(),
+        'values': revenue[kept].tolist(),
+        'title': 'Revenue Forecast',
+        'xlabel': 'Date',
+        'ylabel': 'Revenue'
+    })
+    return charts
+
+
+def column_mean(values):
+    return float(np.mean(values)) if len(values) else float('nan')
+
+
+def build_report(columns):
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+    # Charts and metrics are computed straight from the columns; the PDF
+    # gets a handful of numbers per chart.
+    with timed('report.aggregates'):
+        chart_data = report_charts(columns)
+    with timed('report.charts'):
+        charts = [render_chart(chart) for chart in chart_data]
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles = getSampleStyleSheet()
+    story = []
+
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        spaceAfter=30,
+        textColor=colors.HexColor("#2E4053")
+    )
+    story.append(Paragraph("Ad Performance Report", title_style))
+    story.append(Spacer(1, 12))
+
+    last_updated = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    story.append(Paragraph(f"Last Updated: {last_updated}", styles['Normal']))
+    story.append(Spacer(1, 12))
+
+    key_metrics_style = ParagraphStyle(
+        'KeyMetrics',
+        parent=styles['Heading2'],
+        fontSize=18,
+        spaceAfter=20,
+        textColor=colors.HexColor("#2874A6")
+    )
+    story.append(Paragraph("Key Metrics", key_metrics_style))
+    story.append(Spacer(1, 12))
+
+    metrics = [
+        ["Metric", "Value"],
+        ["Average Revenue", f"${column_mean(columns['Revenue']):.2f}"],
+        ["Average CTR", f"{column_mean(columns['CTR']):.2f}%"],
+        ["Average CPC", f"${column_mean(columns['CPC']):.2f}"],
+        ["Average ROAS", f"{column_mean(columns['ROAS']):.2f}"],
+        ["Total Conversions", f"{columns['Conversions'].sum(dtype=np.int64)}"],
+        ["Total Impressions", f"{columns['Impressions'].sum(dtype=np.int64)}"],
+        ["Total Clicks", f"{columns['Clicks'].sum(dtype=np.int64)}"],
+        ["Total Spend", f"${columns['Spend'].sum():.2f}"]
+    ]
+
+    table = Table(metrics)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#1ABC9C")),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 14),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor("#A9DFBF")),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    story.append(table)
+    story.append(Spacer(1, 12))
+
+    for drawing in charts:
+        story.append(drawing)
+        story.append(Spacer(1, 12))
+
+    with timed('report.pdf'):
+        doc.build(story)
+    return buffer.getvalue()
+
+
+class ReportService:
+    # Builds report PDFs off the request path. One builder thread runs at a
+    # time; the newest PDF is cached with the data version it was built from
+    # and the time its build started, so downloads of unchanged data are
+    # served from memory. A job is identified by the time it was requested,
+    # which every worker can answer: any PDF built from data read after that
+    # time completes it, so polls stop at the first finished build.
+    #
+    # With a `directory` shared by the workers, finished PDFs and failures
+    # are also written there, named by build start and data version, so a
+    # poll answered by another worker finds them. Only requests start
+    # builds; a poll that finds nothing after `timeout` seconds fails.
+    def __init__(self, source, directory=None, keep=4, timeout=300):
+        self._source = source
+        self.directory = directory
+        self.keep = keep
+        self.timeout = timeout
+        self._builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='report')
+        self._lock = threading.Lock()
+        self._running = None
+        self._error = None
+        self.cached = None
+
+    def request(self, requested_at, version, start=True):
+        # Returns ('done', (pdf, filename)), ('running', None) or ('failed',
+        # message) for a report requested at `requested_at` (epoch seconds);
+        # `version` is this process's current data version. Polls pass
+        # start=False.
+        with self._lock:
+            if self.cached is not None:
+                cached_version, started, pdf, filename = self.cached
+                if started >= requested_at or cached_version >= version:
+                    return 'done', (pdf, filename)
+            if self._error is not None:
+                error, self._error = self._error, None
+                return 'failed', error
+        if self.directory is not None:
+            shared = self._shared(requested_at, version)
+            if shared is not None:
+                return shared
+        with self._lock:
+            if self._running is None and start:
+                self._running = self._builder.submit(self._build)
+            elif self._running is None and time.time() - requested_at > self.timeout:
+                return 'failed', "the report was not built in time"
+            return 'running', None
+
+    def _shared(self, requested_at, version):
+        # The newest report in the directory that completes the request.
+        try:
+            names = sorted(os.listdir(self.directory), reverse=True)
+        except FileNotFoundError:
+            return None
+        for name in names:
+            stem, extension = os.path.splitext(name)
+            if not name.endswith(('.pdf', '.failed')):
+                continue
+            started, built_version = (float(part) for part in stem.split('_'))
+            if started < requested_at and (extension == '.failed' or built_version < version):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'rb') as report_file:
+                    content = report_file.read()
+            except FileNotFoundError:
+                continue
+            if extension == '.failed':
+                return 'failed', content.decode()
+            return 'done', (content, report_filename(started))
+        return None
+
+    def _publish(self, started, version, extension, content):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{started:017.6f}_{version}{extension}"
+        temporary = os.path.join(self.directory, name + '.tmp')
+        with open(temporary, 'wb') as report_file:
+            report_file.write(content)
+        os.replace(temporary, os.path.join(self.directory, name))
+        published = [name for name in os.listdir(self.directory) if name.endswith(('.pdf', '.failed'))]
+        for old in sorted(published, reverse=True)[self.keep:]:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except FileNotFoundError:
+                pass
+
+    def _build(self):
+        started = time.time()
+        version = -1
+        try:
+            version, columns = self._source()
+            pdf = build_report(columns)
+            filename = report_filename(started)
+            if self.directory is not None:
+                self._publish(started, version, '.pdf', pdf)
+            with self._lock:
+                self.cached = (version, started, pdf, filename)
+        except Exception as error:
+            if self.directory is not None:
+                try:
+                    self._publish(started, version, '.failed', str(error).encode())
+                except OSError:
+                    pass
+            with self._lock:
+                self._error = str(error)
+        finally:
+            with self._lock:
+                self._running = None
+
+
+def report_filename(started):
+    return f"ad_performance_report_{datetime.fromtimestamp(started).strftime('%Y%m%d_%H%M%S')}.pdf"
@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from campaign_data import columns_to_frame
+
+campaign_schema = {
+    "CampaignID": np.uint32,
+    "AdType": np.int8,
+    "Region": np.int8,
+    "Device": np.int8,
+    "Impressions": np.int32,
+    "Clicks": np.int32,
+    "CTR": np.float64,
+    "CPC": np.float64,
+    "Conversions": np.int32,
+    "Revenue": np.float64,
+    "Spend": np.float64,
+    "ROAS": np.float64,
+    "RPC": np.float64,
+    "CPA": np.float64,
+    "ConversionRate": np.float64,
+    "BounceRate": np.float64,
+    "ROI": np.float64,
+    "Period": np.int8,
+    "Timestamp": np.float64,
+}
+
+
+def allocate_local(name, shape, dtype):
+    return np.zeros(shape, dtype=dtype)
+
+
+class SeqLock:
+    # Sequence lock over a one-element int64 array: the single writer makes
+    # the counter odd while it writes, readers retry until they see the same
+    # even value before and after reading. Readers never block the writer,
+    # which also works across processes when the array is in shared memory.
+    def __init__(self, cell):
+        self._cell = cell
+
+    @contextmanager
+    def write(self):
+        self._cell[0] += 1
+        try:
+            yield
+        finally:
+            self._cell[0] += 1
+
+    def read(self, reader):
+        while True:
+            sequence = int(self._cell[0])
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            result = reader()
+            if int(self._cell[0]) == sequence:
+                return result
+
+
+class CampaignRingBuffer:
+    def __init__(self, capacity=50, schema=campaign_schema, allocate=allocate_local):
+        # `allocate(name, shape, dtype)` provides zero-filled storage; the
+        # default keeps everything in this process, shared_store passes an
+        # allocator backed by shared memory.
+        self.capacity = int(capacity)
+        self.schema = dict(schema)
+        # Every row is stored twice, at i and i + capacity, so the live window
+        # is always one contiguous slice.
+        self._columns = {
+            name: allocate(name, 2 * self.capacity, dtype)
+            for name, dtype in self.schema.items()
+        }
+        # [sequence, head, size, version, epoch]; version is the total number
+        # of records ever appended and doubles as the data version, epoch
+        # tells this window apart from one created by an earlier run.
+        self._state = allocate('state', 5, np.int64)
+        if self._state[4] == 0:
+            self._state[4] = int.from_bytes(os.urandom(6), 'big') | 1
+        self.seqlock = SeqLock(self._state[0:1])
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def __len__(self):
+        return int(self._state[2])
+
+    @property
+    def version(self):
+        return int(self._state[3])
+
+    @property
+    def epoch(self):
+        return int(self._state[4])
+
+    def _window(self, start, count):
+        return {name: column[start:start + count] for name, column in self._columns.items()}
+
+    def recover(self):
+        # A writer that died inside append() leaves the sequence odd, which
+        # would stall readers forever; the next writer closes it.
+        if self._state[0] & 1:
+            self._state[0] += 1
+
+    def subscribe(self, listener):
+        # listener(added, evicted) runs inside the write section after each
+        # append with every appended row and the rows that fell out of the
+        # window. Of a batch larger than the window only the newest rows
+        # stay; the others are both added and evicted, so listeners that
+        # cover the stream rather than the window (the rollups) see them too.
+        self._listeners.append(listener)
+
+    def append(self, batch):
+        count = len(batch["Clicks"])
+        if count == 0:
+            return
+        capacity = self.capacity
+        with self._lock, self.seqlock.write():
+            head, size = int(self._state[1]), int(self._state[2])
+            added = batch
+            written = min(count, capacity)
+            dropped = count - written
+            if dropped:
+                batch = {name: values[dropped:] for name, values in batch.items()}
+            evicted = None
+            overflow = size + written - capacity
+            if self._listeners and (overflow > 0 or dropped):
+                start = (head - size) % capacity
+                evicted = {name: values.copy() for name, values in self._window(start, max(overflow, 0)).items()}
+                if dropped:
+                    evicted = {name: np.concatenate([values, added[name][:dropped]]) for name, values in evicted.items()}
+            first = min(written, capacity - head)
+            rest = written - first
+            for name, column in self._columns.items():
+                values = batch[name]
+                column[head:head + first] = values[:first]
+                column[head + capacity:head + capacity + first] = values[:first]
+                column[:rest] = values[first:]
+                column[capacity:capacity + rest] = values[first:]
+            self._state[1] = (head + written) % capacity
+            self._state[2] = min(size + written, capacity)
+            self._state[3] += count
+            for listener in self._listeners:
+                listener(added, evicted)
+
+    def snapshot(self, reduce=None):
+        # (version, columns) as of one consistent moment. The window is only
+        # valid inside the seqlock reader, since an append overwrites the
+        # oldest rows in place, so the columns are copied there; or, to avoid
+        # copying the whole window, `reduce(views)` runs there instead and
+        # its result is returned. `reduce` may run more than once and must
+        # not keep the views.
+        def read():
+            head, size, version = (int(value) for value in self._state[1:4])
+            columns = self._window((head - size) % self.capacity, size)
+            if reduce is not None:
+                return version, reduce(columns)
+            return version, {name: values.copy() for name, values in columns.items()}
+        return self.seqlock.read(read)
+
+    def frame(self):
+        return columns_to_frame(self.snapshot()[1])
@@ -0,0 +1,124 @@
+import threading
+
+import numpy as np
+
+from ring_buffer import allocate_local
+
+# resolution -> (bucket seconds, buckets kept)
+resolutions = {
+    'minute': (60, 2 * 24 * 60),
+    'hour': (3600, 90 * 24),
+    'day': (86400, 10 * 366),
+}
+
+
+class TimeRollups:
+    # Per-minute, per-hour and per-day means of a few columns by Timestamp.
+    # Each resolution is a ring of fixed slots indexed by bucket number, so
+    # memory does not depend on how many records have been seen. Unlike
+    # StreamingAggregates the rollups are not reduced on eviction: they keep
+    # covering the stream after records leave the window, until their slot
+    # is reused by a newer bucket.
+    columns = ("ConversionRate", "BounceRate")
+
+    def __init__(self, allocate=allocate_local, seqlock=None, resolutions=resolutions):
+        self._lock = threading.Lock()
+        self._seqlock = seqlock
+        self.resolutions = dict(resolutions)
+        self.ids = {}
+        self.counts = {}
+        self.sums = {}
+        for name, (seconds, slots) in self.resolutions.items():
+            # ids hold bucket number + 1, so a zero slot is empty
+            self.ids[name] = allocate('rollup:' + name + ':ids', slots, np.int64)
+            self.counts[name] = allocate('rollup:' + name + ':count', slots, np.int64)
+            self.sums[name] = allocate('rollup:' + name + ':sums', (len(self.columns), slots), np.float64)
+
+    def _read(self, reader):
+        if self._seqlock is not None:
+            return self._seqlock.read(reader)
+        with self._lock:
+            return reader()
+
+    def _apply(self, name, timestamps, values):
+        seconds, slots = self.resolutions[name]
+        ids, counts, sums = self.ids[name], self.counts[name], self.sums[name]
+        buckets = np.floor(timestamps / seconds).astype(np.int64)
+        # Only the newest `slots` buckets fit, and records older than what a
+        # slot already holds are dropped.
+        keep = buckets > max(buckets.max(), ids.max() - 1) - slots
+        buckets, values = buckets[keep], values[:, keep]
+        if len(buckets) == 0:
+            return
+        unique, inverse = np.unique(buckets, return_inverse=True)
+        slot = unique % slots
+        current = ids[slot] - 1
+        fresh = current < unique
+        counts[slot[fresh]] = 0
+        sums[:, slot[fresh]] = 0
+        ids[slot[fresh]] = unique[fresh] + 1
+        live = current <= unique
+        counts[slot[live]] += np.bincount(inverse, minlength=len(unique))[live]
+        for row in range(len(self.columns)):
+            sums[row, slot[live]] += np.bincount(inverse, weights=values[row], minlength=len(unique))[live]
+
+    def update(self, added, evicted=None):
+        timestamps = np.asarray(added["Timestamp"], dtype=np.float64)
+        if len(timestamps) == 0:
+            return
+        values = np.vstack([np.asarray(added[column], dtype=np.float64) for column in self.columns])
+        with self._lock:
+            for name in self.resolutions:
+                self._apply(name, timestamps, values)
+
+    def covers(self, name, start):
+        # Whether the resolution still holds every bucket from `start` on.
+        seconds, slots = self.resolutions[name]
+        newest = int(self._read(lambda: self.ids[name].max())) - 1
+        return newest < 0 or np.floor(start / seconds) > newest - slots
+
+    def series(self, name, start=None, end=None):
+        # Bucket start times and per-column means of the non-empty buckets
+        # overlapping [start, end], oldest first.
+        seconds = self.resolutions[name][0]
+
+        def read():
+            return self.ids[name].copy(), self.counts[name].copy(), self.sums[name].copy()
+        ids, counts, sums = self._read(read)
+        selected = (ids > 0) & (counts > 0)
+        if start is not None:
+            selected &= ids > np.floor(start / seconds)
+        if end is not None:
+            selected &= ids - 1 <= np.floor(end / seconds)
+        order = np.flatnonzero(selected)[np.argsort(ids[selected], kind='stable')]
+        times = ((ids[order] - 1) * seconds).astype(np.float64)
+        return times, {column: sums[row, order] / counts[order] for row, column in enumerate(self.columns)}
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the first and last points and,
+    # from each of `threshold - 2` equal buckets in between, the point that
+    # spans the largest triangle with the previously kept point and the
+    # mean of the next bucket. Returns the indexes of the kept points.
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.intp)
+    kept = np.empty(threshold, dtype=np.intp)
+    kept[0], kept[-1] = 0, count - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        low, high = edges[bucket], edges[bucket + 1]
+        next_low, next_high = high, edges[bucket + 2] if bucket + 2 < len(edges) else count
+        if next_high <= next_low:
+            next_high = next_low + 1
+        mean_x, mean_y = x[next_low:next_high].mean(), y[next_low:next_high].mean()
+        areas = np.abs(
+            (x[previous] - mean_x) * (y[low:high] - y[previous])
+            - (x[previous] - x[low:high]) * (mean_y - y[previous])
+        )
+        previous = low + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
@@ -0,0 +1,114 @@
+import fcntl
+import os
+import tempfile
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from aggregates import StreamingAggregates
+from ring_buffer import CampaignRingBuffer
+from rollups import TimeRollups
+from sketches import CampaignSketches
+
+MAGIC = 0x41444C4942530001
+HEADER_BYTES = 64
+ALIGNMENT = 64
+
+
+class ArenaAllocator:
+    # Hands out consecutive, aligned slices of one buffer. Creator and
+    # readers build the same objects in the same order, so they agree on the
+    # layout without exchanging it. With no buffer it only measures.
+    def __init__(self, buffer=None, offset=HEADER_BYTES):
+        self._buffer = buffer
+        self.size = offset
+
+    def __call__(self, name, shape, dtype):
+        dtype = np.dtype(dtype)
+        offset = -(-self.size // ALIGNMENT) * ALIGNMENT
+        self.size = offset + int(np.prod(shape)) * dtype.itemsize
+        if self._buffer is None:
+            return np.zeros(shape, dtype=dtype)
+        return np.ndarray(shape, dtype=dtype, buffer=self._buffer, offset=offset)
+
+
+def build_store(capacity, allocate):
+    buffer = CampaignRingBuffer(capacity=capacity, allocate=allocate)
+    aggregates = StreamingAggregates(allocate=allocate, seqlock=buffer.seqlock)
+    sketches = CampaignSketches(allocate=allocate, seqlock=buffer.seqlock)
+    rollups = TimeRollups(allocate=allocate, seqlock=buffer.seqlock)
+    return buffer, aggregates, sketches, rollups
+
+
+class SharedCampaignStore:
+    # One campaign window shared by every worker process of a deployment.
+    # The first process to take the producer lock owns all writes (and runs
+    # the generator); every other process maps the same segment read-only in
+    # practice and takes lock-free seqlock snapshots.
+    def __init__(self, name, capacity, lock_dir=None, attach_timeout=30):
+        self.name = name
+        self.capacity = int(capacity)
+        layout = ArenaAllocator()
+        build_store(self.capacity, layout)
+        self.size = layout.size
+
+        lock_path = os.path.join(lock_dir or tempfile.gettempdir(), f"{name}.producer.lock")
+        self._lock_file = open(lock_path, 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.is_producer = True
+        except BlockingIOError:
+            self.is_producer = False
+
+        if self.is_producer:
+            self._shm = self._open_as_producer()
+        else:
+            self._shm = self._attach(attach_timeout)
+        # The segment outlives any single worker; stop Python from unlinking
+        # it when this process exits.
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+
+        self._header = np.ndarray(3, dtype=np.int64, buffer=self._shm.buf)
+        self.buffer, self.aggregates, self.sketches, self.rollups = build_store(self.capacity, ArenaAllocator(self._shm.buf))
+        if self.is_producer:
+            self.buffer.recover()
+            self.buffer.subscribe(self.aggregates.update)
+            self.buffer.subscribe(self.sketches.update)
+            self.buffer.subscribe(self.rollups.update)
+            self._header[:] = (MAGIC, self.size, 1)
+
+    def _valid(self, shm):
+        header = np.ndarray(3, dtype=np.int64, buffer=shm.buf)
+        return shm.size >= self.size and header[0] == MAGIC and header[1] == self.size
+
+    def _open_as_producer(self):
+        # A restarted producer keeps writing into the existing segment when
+        # its layout matches, so readers keep their mapping and the window
+        # survives; a segment with another layout is replaced.
+        try:
+            shm = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return shared_memory.SharedMemory(name=self.name, create=True, size=self.size)
+        if self._valid(shm):
+            return shm
+        shm.close()
+        shm.unlink()
+        return shared_memory.SharedMemory(name=self.name, create=True, size=self.size)
+
+    def _attach(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                shm = shared_memory.SharedMemory(name=self.name)
+                if self._valid(shm) and np.ndarray(3, dtype=np.int64, buffer=shm.buf)[2]:
+                    return shm
+                shm.close()
+            except FileNotFoundError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Shared store '{self.name}' was not created by a producer")
+            time.sleep(0.1)
+
+    def unlink(self):
+        self._shm.unlink()
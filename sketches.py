@@ -0,0 +1,100 @@
+import math
+import threading
+
+import numpy as np
+
+from ring_buffer import allocate_local
+
+
+class QuantileSketch:
+    # DDSketch-style quantile sketch: values are counted in logarithmic
+    # buckets, so any quantile is within `relative_accuracy` of the true
+    # value while memory stays fixed. Unlike t-digest or KLL, plain bucket
+    # counts can be subtracted as well as added, which lets the sketch follow
+    # a sliding window, and two sketches with the same parameters merge by
+    # adding their counts. Values at or below `min_value` share one bucket
+    # and are reported as 0; values above `max_value` are clamped.
+    def __init__(self, relative_accuracy=0.01, min_value=0.01, max_value=1e7, counts=None):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self._offset = math.ceil(math.log(min_value) / self._log_gamma)
+        self.size = math.ceil(math.log(max_value) / self._log_gamma) - self._offset + 2
+        self.counts = np.zeros(self.size, dtype=np.int64) if counts is None else counts
+
+    def _buckets(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        buckets = np.zeros(len(values), dtype=np.intp)
+        positive = values > self.min_value
+        indexes = np.ceil(np.log(values[positive]) / self._log_gamma) - self._offset + 1
+        buckets[positive] = np.clip(indexes, 1, self.size - 1)
+        return buckets
+
+    def add(self, values, sign=1):
+        self.counts += sign * np.bincount(self._buckets(values), minlength=self.size)
+
+    def merge(self, other):
+        if other.size != self.size or other.gamma != self.gamma:
+            raise ValueError("sketches with different parameters cannot be merged")
+        self.counts += other.counts
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def quantiles(self, qs, counts=None):
+        counts = self.counts if counts is None else counts
+        total = counts.sum()
+        if total <= 0:
+            return [0.0 for _ in qs]
+        cumulative = np.cumsum(counts)
+        results = []
+        for q in qs:
+            bucket = int(np.searchsorted(cumulative, q * (total - 1), side='right'))
+            if bucket == 0:
+                results.append(0.0)
+            else:
+                # midpoint (in relative terms) of the bucket's value range
+                exponent = bucket - 1 + self._offset
+                results.append(2 * self.gamma ** exponent / (self.gamma + 1))
+        return results
+
+    def quantile(self, q):
+        return self.quantiles([q])[0]
+
+
+class CampaignSketches:
+    # One quantile sketch per column, kept in step with the window like
+    # StreamingAggregates: added rows are counted in and evicted rows counted
+    # out. The counts come from `allocate`, so under the shared store every
+    # worker reads the same sketches.
+    columns = ("CPA", "CPC", "RPC", "BounceRate")
+
+    def __init__(self, allocate=allocate_local, seqlock=None, relative_accuracy=0.01):
+        self._lock = threading.Lock()
+        self._seqlock = seqlock
+        self.sketches = {}
+        for column in self.columns:
+            sketch = QuantileSketch(relative_accuracy)
+            sketch.counts = allocate('sketch:' + column, sketch.size, np.int64)
+            self.sketches[column] = sketch
+
+    def _read(self, reader):
+        if self._seqlock is not None:
+            return self._seqlock.read(reader)
+        with self._lock:
+            return reader()
+
+    def update(self, added, evicted=None):
+        with self._lock:
+            for column, sketch in self.sketches.items():
+                sketch.add(added[column])
+                if evicted is not None:
+                    sketch.add(evicted[column], sign=-1)
+
+    def quantiles(self, column, qs):
+        sketch = self.sketches[column]
+        counts = self._read(lambda: sketch.counts.copy())
+        return sketch.quantiles(qs, counts)
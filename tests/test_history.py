@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pytest
+
+from campaign_data import generate_campaign_columns
+from history import CampaignHistory
+
+
+def batch(count, timestamp, seed=0):
+    return generate_campaign_columns(count, seed=seed, timestamp=timestamp)
+
+
+def test_reopen_drops_torn_tail(tmp_path):
+    history = CampaignHistory(str(tmp_path), segment_rows=100)
+    history.append(batch(7, 1000.0))
+    # a crash halfway through writing the next batch: one column got a row
+    # and part of another, the others nothing
+    with open(os.path.join(tmp_path, 'segment-000000', 'Revenue'), 'ab') as column_file:
+        column_file.write(b'\0' * 12)
+
+    reopened = CampaignHistory(str(tmp_path), segment_rows=100)
+    assert len(reopened) == 7
+    reopened.append(batch(3, 2000.0, seed=1))
+    columns = reopened.read()
+    assert len(columns['Revenue']) == 10
+    assert np.array_equal(columns['Timestamp'], [1000.0] * 7 + [2000.0] * 3)
+
+
+def test_reopen_seals_full_active_segment(tmp_path):
+    history = CampaignHistory(str(tmp_path), segment_rows=10)
+    history.append(batch(10, 1000.0))
+    # a crash after the segment's last rows were written but before its
+    # meta.json
+    os.remove(os.path.join(tmp_path, 'segment-000000', 'meta.json'))
+
+    reopened = CampaignHistory(str(tmp_path), segment_rows=10)
+    assert os.path.exists(os.path.join(tmp_path, 'segment-000000', 'meta.json'))
+    reopened.append(batch(5, 2000.0, seed=1))
+    assert len(reopened) == 15
+    assert np.array_equal(reopened.read(start=1500)['Timestamp'], [2000.0] * 5)
+    assert len(CampaignHistory(str(tmp_path), segment_rows=10).read()['Timestamp']) == 15
+
+
+def test_malformed_batch_writes_nothing(tmp_path):
+    history = CampaignHistory(str(tmp_path), segment_rows=100)
+    history.append(batch(4, 1000.0))
+    malformed = batch(2, 2000.0, seed=1)
+    malformed['Impressions'] = np.ones((2, 2))
+    with pytest.raises(ValueError):
+        history.append(malformed)
+    short = batch(2, 2000.0, seed=1)
+    short['Revenue'] = short['Revenue'][:1]
+    with pytest.raises(ValueError):
+        history.append(short)
+
+    reopened = CampaignHistory(str(tmp_path), segment_rows=100)
+    assert len(reopened) == 4
+
+
+def test_readonly_view_follows_writer(tmp_path):
+    history = CampaignHistory(str(tmp_path), segment_rows=10)
+    reader = CampaignHistory(str(tmp_path), readonly=True)
+    history.append(batch(15, 1000.0))
+    assert len(reader.read()['Timestamp']) == 15
+    history.append(batch(3, 2000.0, seed=1))
+    assert np.array_equal(reader.read(start=1500)['Timestamp'], [2000.0] * 3)
+    with pytest.raises(ValueError):
+        reader.append(batch(1, 3000.0))
@@ -0,0 +1,52 @@
+import json
+
+import numpy as np
+import pytest
+
+from campaign_data import generate_campaign_columns
+from ingest import IngestError, append_batches, parse_ndjson
+
+event = {
+    "AdType": "Search", "Region": "Canada", "Device": "Mobile", "Period": "Monday Morning",
+    "Impressions": 1000, "Clicks": 10, "CPC": 1.5, "Conversions": 1, "Revenue": 5.0, "BounceRate": 40,
+}
+
+
+def test_valid_event():
+    batch = parse_ndjson(json.dumps(dict(event, Timestamp=1700000000, CampaignID="ffffffff")))
+    assert batch["Impressions"].tolist() == [1000]
+    assert batch["CampaignID"].tolist() == [0xffffffff]
+    assert batch["Timestamp"].tolist() == [1700000000.0]
+
+
+@pytest.mark.parametrize("fields", [
+    {"Timestamp": "yesterday"},
+    {"Timestamp": "NaN"},
+    {"CampaignID": -1},
+    {"CampaignID": "-1"},
+    {"CampaignID": "campaign"},
+    {"Impressions": 1e40},
+    {"Impressions": 2 ** 31},
+    {"AdType": ["Search"]},
+    {"AdType": 1},
+    {"Impressions": [1000, 2000]},
+    {"Impressions": "1000"},
+    {"Impressions": True},
+    {"Impressions": None},
+])
+def test_invalid_event(fields):
+    with pytest.raises(IngestError), np.errstate(all='raise'):
+        parse_ndjson(json.dumps(dict(event, **fields)))
+
+
+def test_bad_batch_does_not_drop_others():
+    good = generate_campaign_columns(3, seed=0, timestamp=1000.0)
+    appended = []
+
+    def sink(batch):
+        if len(batch) != len(good):
+            raise ValueError("bad batch")
+        appended.append(len(batch["Timestamp"]))
+
+    append_batches(sink, [good, {"Timestamp": good["Timestamp"]}, good])
+    assert appended == [3, 3]
@@ -0,0 +1,58 @@
+import numpy as np
+
+from campaign_data import generate_campaign_columns
+from ring_buffer import allocate_local
+from shared_store import build_store
+from sketches import QuantileSketch
+
+
+def batch(count, timestamp, seed=0):
+    columns = generate_campaign_columns(count, seed=seed, timestamp=timestamp)
+    # row numbers, to tell which rows were kept and evicted
+    columns["CampaignID"] = np.arange(count, dtype=np.uint32) + int(timestamp)
+    return columns
+
+
+def store(capacity):
+    buffer, aggregates, sketches, rollups = build_store(capacity, allocate_local)
+    calls = []
+    buffer.subscribe(aggregates.update)
+    buffer.subscribe(sketches.update)
+    buffer.subscribe(rollups.update)
+    buffer.subscribe(lambda added, evicted: calls.append((added, evicted)))
+    return buffer, aggregates, sketches, rollups, calls
+
+
+def test_batch_larger_than_capacity():
+    buffer, aggregates, sketches, rollups, calls = store(10)
+    first, second = batch(4, 1000.0), batch(25, 2000.0, seed=1)
+    buffer.append(first)
+    buffer.append(second)
+
+    added, evicted = calls[-1]
+    assert np.array_equal(added["CampaignID"], second["CampaignID"])
+    assert np.array_equal(evicted["CampaignID"], np.concatenate([first["CampaignID"], second["CampaignID"][:15]]))
+
+    version, window = buffer.snapshot()
+    assert version == 29 and len(buffer) == 10
+    assert np.array_equal(window["CampaignID"], second["CampaignID"][15:])
+    assert np.array_equal(aggregates.counts.sum(axis=(1, 2, 3)), np.bincount(window["AdType"], minlength=aggregates.shape[0]))
+    for column, sketch in sketches.sketches.items():
+        expected = QuantileSketch(sketch.relative_accuracy)
+        expected.add(window[column])
+        assert np.array_equal(sketch.counts, expected.counts)
+    # the rollups cover the stream, including rows that never stayed
+    assert rollups.counts['minute'].sum() == 29
+
+
+def test_append_wraps_around():
+    buffer, aggregates, sketches, rollups, calls = store(10)
+    first, second = batch(6, 1000.0), batch(7, 2000.0, seed=1)
+    buffer.append(first)
+    buffer.append(second)
+
+    added, evicted = calls[-1]
+    assert np.array_equal(evicted["CampaignID"], first["CampaignID"][:3])
+    window = buffer.snapshot()[1]
+    assert np.array_equal(window["CampaignID"], np.concatenate([first["CampaignID"][3:], second["CampaignID"]]))
+    assert aggregates.counts.sum() == 10
@@ -0,0 +1,38 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+from campaign_data import generate_campaign_columns
+from shared_store import SharedCampaignStore
+
+
+def attach(name, lock_dir, results):
+    store = SharedCampaignStore(name, 20, lock_dir=lock_dir, attach_timeout=10)
+    version, columns = store.buffer.snapshot()
+    results.put((store.is_producer, store.buffer.epoch, version, columns, int(store.aggregates.counts.sum())))
+
+
+def test_second_process_sees_the_same_window(tmp_path):
+    name = f"adlibs-test-{os.getpid()}"
+    producer = SharedCampaignStore(name, 20, lock_dir=str(tmp_path))
+    try:
+        assert producer.is_producer
+        producer.buffer.append(generate_campaign_columns(15, seed=0, timestamp=1000.0))
+        producer.buffer.append(generate_campaign_columns(15, seed=1, timestamp=2000.0))
+
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        reader = context.Process(target=attach, args=(name, str(tmp_path), results))
+        reader.start()
+        is_producer, epoch, version, columns, count = results.get(timeout=60)
+        reader.join(timeout=60)
+
+        assert not is_producer
+        expected_version, expected = producer.buffer.snapshot()
+        assert (epoch, version, count) == (producer.buffer.epoch, expected_version, 20)
+        assert version == 30
+        for column, values in expected.items():
+            assert np.array_equal(columns[column], values)
+    finally:
+        producer.unlink()